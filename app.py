@@ -1,17 +1,849 @@
-from flask import Flask, request
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from flask import Flask, Response, abort, jsonify, request
+from urllib.parse import parse_qs
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import parse_etags
+import asyncio
+import atexit
+import contextvars
+import functools
+import gzip
+import hashlib
+import hmac
+import html
+import json
+import math
 import os
+import sys
+import threading
+import time
+
+import profiler
+import resolver
+import snapshot
+from cache import AnswerCache, SingleFlight
+from limits import AdmissionController, Overloaded, RateLimiter
+from metrics import Counters, Histograms, metric_lines
+from shared_cache import SharedAnswerCache
 
 app = Flask(__name__)
+app.config['DNS_BACKEND'] = os.environ.get('DNS_BACKEND', 'native')
+app.config['DNS_SERVER'] = os.environ.get('DNS_SERVER') or resolver.default_nameserver()
+app.config['DNS_PORT'] = int(os.environ.get('DNS_PORT', 53))
+app.config['DNS_TIMEOUT'] = float(os.environ.get('DNS_TIMEOUT', 2.0))
+app.config['DNS_CACHE_SIZE'] = int(os.environ.get('DNS_CACHE_SIZE', 10000))
+app.config['DNS_NEGATIVE_CACHE_SIZE'] = int(os.environ.get('DNS_NEGATIVE_CACHE_SIZE', 10000))
+# getaddrinfo and nslookup report no TTLs, so their answers are kept for a fixed time
+app.config['DNS_DEFAULT_TTL'] = int(os.environ.get('DNS_DEFAULT_TTL', 60))
+app.config['DNS_BACKEND_WORKERS'] = int(os.environ.get('DNS_BACKEND_WORKERS', 16))
+app.config['DNS_BATCH_MAX'] = int(os.environ.get('DNS_BATCH_MAX', 10000))
+app.config['DNS_BATCH_WINDOW'] = int(os.environ.get('DNS_BATCH_WINDOW', 64))
+# Hot entries are refreshed in the background once this fraction of their TTL
+# remains; 0 disables prefetching
+app.config['DNS_PREFETCH_FRACTION'] = float(os.environ.get('DNS_PREFETCH_FRACTION', 0.1))
+app.config['DNS_PREFETCH_MIN_HITS'] = int(os.environ.get('DNS_PREFETCH_MIN_HITS', 2))
+app.config['DNS_REFRESH_WORKERS'] = int(os.environ.get('DNS_REFRESH_WORKERS', 4))
+# Serve-stale (RFC 8767): answer from an expired entry, kept up to DNS_STALE_TTL
+# seconds, when no fresh answer arrives within DNS_STALE_DEADLINE seconds
+app.config['DNS_SERVE_STALE'] = os.environ.get('DNS_SERVE_STALE', '0') == '1'
+app.config['DNS_STALE_TTL'] = int(os.environ.get('DNS_STALE_TTL', 86400))
+app.config['DNS_STALE_DEADLINE'] = float(os.environ.get('DNS_STALE_DEADLINE', 1.8))
+# After a failed refresh, stale records are served at once for this many seconds
+app.config['DNS_STALE_RECHECK'] = float(os.environ.get('DNS_STALE_RECHECK', 30))
+# The answer cache is written to this file every DNS_SNAPSHOT_INTERVAL seconds
+# and on exit, and read back lazily at startup
+app.config['DNS_SNAPSHOT_PATH'] = os.environ.get('DNS_SNAPSHOT_PATH')
+app.config['DNS_SNAPSHOT_INTERVAL'] = float(os.environ.get('DNS_SNAPSHOT_INTERVAL', 300))
+# Worker processes on one host can share answers through a mmap'd table at
+# this path (e.g. under /dev/shm), consulted after the per-process cache
+app.config['DNS_SHARED_CACHE_PATH'] = os.environ.get('DNS_SHARED_CACHE_PATH')
+app.config['DNS_SHARED_CACHE_SLOTS'] = int(os.environ.get('DNS_SHARED_CACHE_SLOTS', 65536))
+# Admission control: at most DNS_MAX_INFLIGHT lookup requests run at once and
+# DNS_ADMISSION_QUEUE more wait up to DNS_ADMISSION_WAIT seconds; the rest get 503
+app.config['DNS_MAX_INFLIGHT'] = int(os.environ.get('DNS_MAX_INFLIGHT', 64))
+app.config['DNS_ADMISSION_QUEUE'] = int(os.environ.get('DNS_ADMISSION_QUEUE', 64))
+app.config['DNS_ADMISSION_WAIT'] = float(os.environ.get('DNS_ADMISSION_WAIT', 0.5))
+app.config['DNS_ASYNC_MAX_INFLIGHT'] = int(os.environ.get('DNS_ASYNC_MAX_INFLIGHT', 4096))
+app.config['DNS_RETRY_AFTER'] = int(os.environ.get('DNS_RETRY_AFTER', 1))
+# Per-client token bucket; a rate of 0 disables it. A client is its X-API-Key
+# when that is one of the comma-separated DNS_API_KEYS, else its address
+app.config['DNS_RATE_LIMIT'] = float(os.environ.get('DNS_RATE_LIMIT', 50))
+app.config['DNS_RATE_BURST'] = float(os.environ.get('DNS_RATE_BURST', 100))
+app.config['DNS_RATE_MAX_CLIENTS'] = int(os.environ.get('DNS_RATE_MAX_CLIENTS', 100000))
+app.config['DNS_API_KEYS'] = os.environ.get('DNS_API_KEYS', '')
+# Behind reverse proxies every client arrives from a proxy address and would
+# share one bucket; set this to the number of proxies in front of the app so
+# the client address is taken from X-Forwarded-For instead
+app.config['DNS_PROXY_HOPS'] = int(os.environ.get('DNS_PROXY_HOPS', 0))
+# Rendered (and gzipped) lookup responses, reused while the answer is unchanged
+app.config['DNS_RENDER_CACHE_SIZE'] = int(os.environ.get('DNS_RENDER_CACHE_SIZE', 10000))
+app.config['DNS_GZIP_MIN_SIZE'] = int(os.environ.get('DNS_GZIP_MIN_SIZE', 512))
+# Admin endpoints require "Authorization: Bearer <DNS_ADMIN_TOKEN>" and are
+# disabled when no token is set
+app.config['DNS_ADMIN_TOKEN'] = os.environ.get('DNS_ADMIN_TOKEN')
+app.config['DNS_PROFILE_MAX_SECONDS'] = float(os.environ.get('DNS_PROFILE_MAX_SECONDS', 60))
+
+backend = resolver.make_backend(
+    app.config['DNS_BACKEND'], server=app.config['DNS_SERVER'], port=app.config['DNS_PORT'],
+    timeout=app.config['DNS_TIMEOUT'], default_ttl=app.config['DNS_DEFAULT_TTL'],
+    workers=app.config['DNS_BACKEND_WORKERS'])
+answer_cache = AnswerCache(
+    app.config['DNS_CACHE_SIZE'],
+    prefetch=lambda key: refresh_pool.submit(refresh, key),
+    prefetch_fraction=app.config['DNS_PREFETCH_FRACTION'],
+    prefetch_min_hits=app.config['DNS_PREFETCH_MIN_HITS'],
+    stale_ttl=app.config['DNS_STALE_TTL'] if app.config['DNS_SERVE_STALE'] else 0,
+    stale_recheck=app.config['DNS_STALE_RECHECK'])
+# NXDOMAIN/NODATA answers get their own LRU so they cannot evict positive ones
+negative_cache = AnswerCache(app.config['DNS_NEGATIVE_CACHE_SIZE'])
+render_cache = AnswerCache(app.config['DNS_RENDER_CACHE_SIZE'])
+request_counts = Counters('dns_requests_total', 'Lookup requests by endpoint and status',
+                          ('endpoint', 'status'))
+request_seconds = Histograms('dns_request_seconds', 'Lookup request latency', ('endpoint',))
+stage_seconds = Histograms('dns_stage_seconds', 'Time spent in each lookup stage',
+                           ('stage', 'backend'))
+# Bound once so the hot path does no label lookups
+stage_observers = {stage: stage_seconds.labels(stage, app.config['DNS_BACKEND']).observe
+                   for stage in ('validate', 'cache', 'upstream', 'render')}
+# (stage, seconds) pairs for a request that asked for a Server-Timing header
+request_timings = contextvars.ContextVar('request_timings', default=None)
+flight = SingleFlight()
+batch_pool = ThreadPoolExecutor(app.config['DNS_BATCH_WINDOW'], thread_name_prefix='dns-batch')
+type_pool = ThreadPoolExecutor(app.config['DNS_BACKEND_WORKERS'], thread_name_prefix='dns-type')
+refresh_pool = ThreadPoolExecutor(app.config['DNS_REFRESH_WORKERS'], thread_name_prefix='dns-refresh')
+admission = AdmissionController(app.config['DNS_MAX_INFLIGHT'], app.config['DNS_ADMISSION_QUEUE'],
+                                app.config['DNS_ADMISSION_WAIT'])
+async_admission = AdmissionController(app.config['DNS_ASYNC_MAX_INFLIGHT'])
+rate_limiter = RateLimiter(app.config['DNS_RATE_LIMIT'], app.config['DNS_RATE_BURST'],
+                           app.config['DNS_RATE_MAX_CLIENTS'])
+# Keyed clients are tracked, and listed in the public stats, by a digest of
+# their key rather than the key itself
+api_clients = {key: 'key:' + hashlib.blake2b(key.encode(), digest_size=8).hexdigest()
+               for key in filter(None, (k.strip() for k in app.config['DNS_API_KEYS'].split(',')))}
+snapshot_reader = None
+# Keys answered NXDOMAIN/NODATA since the snapshot was written: its copies of
+# them are ignored on read and dropped from the next snapshot
+removed_keys = set()
+shared_cache = None
+if app.config['DNS_SHARED_CACHE_PATH']:
+    shared_cache = SharedAnswerCache(app.config['DNS_SHARED_CACHE_PATH'],
+                                     app.config['DNS_SHARED_CACHE_SLOTS'])
+
+DEFAULT_TYPES = ('A', 'AAAA')
+CONTENT_TYPES = {'json': 'application/json', 'html': 'text/html; charset=utf-8'}
+
+def stage_done(stage, start):
+    elapsed = time.perf_counter() - start
+    stage_observers[stage](elapsed)
+    timings = request_timings.get()
+    if timings is not None:
+        timings.append((stage, elapsed))
+
+def server_timing(timings, total):
+    durations = {}
+    for stage, elapsed in timings:
+        durations[stage] = durations.get(stage, 0.0) + elapsed
+    durations['total'] = total
+    return ', '.join('%s;dur=%.3f' % (stage, elapsed * 1000) for stage, elapsed in durations.items())
+
+def cache_key(name, rtype):
+    return sys.intern(name), rtype
+
+class Answer(tuple):
+    """Records returned by one lookup and the whole seconds they have been cached.
+
+    Built per lookup: the caches hold plain tuples and work the age out from
+    their entries' TTL and expiry.
+    """
+
+    def __new__(cls, records, age=0):
+        answer = super().__new__(cls, records)
+        answer.age = int(age)
+        return answer
+
+def answer_age(answer):
+    # Stale and empty answers carry their own TTLs and do not count down
+    return answer.age if isinstance(answer, Answer) else 0
+
+def negative_answer(key, rcode):
+    if rcode == 3:
+        raise resolver.NXDomain("** server can't find %s: NXDOMAIN" % key[0])
+    return []
+
+def open_snapshot(path):
+    try:
+        return snapshot.SnapshotReader(path)
+    except (OSError, ValueError) as e:
+        app.logger.warning('not loading DNS cache snapshot %s: %s', path, e)
+        return None
+
+def save_snapshot():
+    global snapshot_reader
+    path = app.config['DNS_SNAPSHOT_PATH']
+    now = time.time()
+    removed = set(removed_keys)
+    entries = {key: (key, records, now + remaining)
+               for key, records, remaining in answer_cache.items()}
+    # Keep entries from the previous snapshot that were never loaded into memory
+    if snapshot_reader is not None:
+        for entry in snapshot_reader.entries():
+            if entry[0] not in removed:
+                entries.setdefault(entry[0], entry)
+    snapshot.write_snapshot(path, entries.values())
+    snapshot_reader = open_snapshot(path)
+    removed_keys.difference_update(removed)
+
+def snapshot_loop():
+    while True:
+        time.sleep(app.config['DNS_SNAPSHOT_INTERVAL'])
+        try:
+            save_snapshot()
+        except OSError as e:
+            app.logger.warning('cannot write DNS cache snapshot: %s', e)
+
+def cached_answer(key):
+    hit = answer_cache.get_aged(key)
+    if hit is not None:
+        return Answer(*hit)
+    for store in (shared_cache, snapshot_reader if key not in removed_keys else None):
+        if store is not None:
+            loaded = store.get(key)
+            if loaded is not None:
+                # Stored TTLs are the original ones; the entry's remaining
+                # lifetime tells how much of the shortest has been used
+                records, remaining = loaded
+                ttl = min(r.ttl for r in records)
+                answer_cache.put(key, records, ttl, ttl - remaining)
+                return Answer(records, ttl - remaining)
+    rcode = negative_cache.get(key)
+    if rcode is not None:
+        return negative_answer(key, rcode)
+    return None
+
+def store_answer(key, rcode, records, negative_ttl):
+    if rcode not in (0, 3):
+        raise resolver.ResolverError('** server failed for %s: rcode %d' % (key[0], rcode))
+    if records:
+        records = tuple(records)
+        ttl = min(r.ttl for r in records)
+        answer_cache.put(key, records, ttl)
+        if shared_cache is not None:
+            shared_cache.put(key, records, ttl)
+        removed_keys.discard(key)
+        return Answer(records)
+    # The name or type is gone, so any stale positive copy must not be served;
+    # an empty shared entry that is already expired hides it from other workers
+    answer_cache.discard(key)
+    if shared_cache is not None:
+        shared_cache.put(key, (), 0)
+    if app.config['DNS_SNAPSHOT_PATH']:
+        removed_keys.add(key)
+    if negative_ttl is not None:
+        negative_cache.put(key, rcode, negative_ttl)
+    return negative_answer(key, rcode)
+
+def query_name(name, rtype):
+    # PTR lookups accept a plain IP address and query its reverse name
+    if rtype == 'PTR':
+        return resolver.reverse_name(name) or name
+    return name
+
+def query_backend(key):
+    start = time.perf_counter()
+    try:
+        return backend.query(*key)
+    finally:
+        stage_done('upstream', start)
+
+async def query_backend_async(key):
+    start = time.perf_counter()
+    try:
+        return await backend.query_async(*key)
+    finally:
+        stage_done('upstream', start)
+
+def resolve_key(key):
+    return flight.do(key, lambda: store_answer(key, *query_backend(key)))
+
+async def resolve_key_async(key):
+    async def resolve():
+        return store_answer(key, *await query_backend_async(key))
+    return await flight.do_async(key, resolve)
+
+def refresh(key):
+    # Background re-resolution of a cache entry; errors leave it to expire normally
+    try:
+        resolve_key(key)
+    except resolver.ResolverError:
+        pass
+
+class StaleAnswer(tuple):
+    """Expired records served because no fresh answer arrived in time."""
+
+def stale_answer(records):
+    # RFC 8767 section 4: stale records are served with a TTL of 30 seconds
+    answer_cache.stale_served()
+    return StaleAnswer(resolver.Record(r.name, r.qtype, 30, r.rdata) for r in records)
+
+# One refresh per expired entry: later requests wait on the same future rather
+# than queueing more upstream queries behind the refresh pool
+stale_refreshes = {}
+stale_refreshes_lock = threading.Lock()
+
+def stale_refresh(key):
+    with stale_refreshes_lock:
+        future = stale_refreshes.get(key)
+        started = future is None
+        if started:
+            future = stale_refreshes[key] = refresh_pool.submit(resolve_key, key)
+    if started:
+        future.add_done_callback(functools.partial(stale_refresh_done, key))
+    return future
+
+def stale_refresh_done(key, future):
+    with stale_refreshes_lock:
+        if stale_refreshes.get(key) is future:
+            del stale_refreshes[key]
+    error = None if future.cancelled() else future.exception()
+    if isinstance(error, resolver.ResolverError) and not isinstance(error, resolver.NXDomain):
+        answer_cache.refresh_failed(key)
+
+def lookup(name, rtype):
+    key = cache_key(query_name(name, rtype), rtype)
+    start = time.perf_counter()
+    records = cached_answer(key)
+    stage_done('cache', start)
+    if records is None:
+        stale = answer_cache.get_stale(key) if app.config['DNS_SERVE_STALE'] else None
+        if stale is None:
+            return resolve_key(key)
+        stale, recheck = stale
+        if recheck:
+            return stale_answer(stale)
+        try:
+            return stale_refresh(key).result(app.config['DNS_STALE_DEADLINE'])
+        except resolver.NXDomain:
+            raise
+        except (FutureTimeoutError, resolver.ResolverError):
+            return stale_answer(stale)
+    return records
+
+async def lookup_async(name, rtype):
+    key = cache_key(query_name(name, rtype), rtype)
+    start = time.perf_counter()
+    records = cached_answer(key)
+    stage_done('cache', start)
+    if records is None:
+        stale = answer_cache.get_stale(key) if app.config['DNS_SERVE_STALE'] else None
+        if stale is None:
+            return await resolve_key_async(key)
+        stale, recheck = stale
+        if recheck:
+            return stale_answer(stale)
+        # Concurrent refreshes of one key share a single upstream query through
+        # the singleflight; the callback also retrieves the task's exception
+        task = asyncio.ensure_future(resolve_key_async(key))
+        task.add_done_callback(functools.partial(stale_refresh_done, key))
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), app.config['DNS_STALE_DEADLINE'])
+        except resolver.NXDomain:
+            raise
+        except (asyncio.TimeoutError, resolver.ResolverError):
+            return stale_answer(stale)
+    return records
+
+def answer_result(name, answers):
+    # TTLs count down from when each answer was resolved, as a resolver's would
+    result = {'domain': name, 'records': [r.as_dict(answer_age(answer))
+                                          for answer in answers for r in answer]}
+    if any(isinstance(answer, StaleAnswer) for answer in answers):
+        result['stale'] = True
+    return result
+
+def submit(pool, fn, *args):
+    # A timed request's context goes with its work so pool threads report into it
+    if request_timings.get() is None:
+        return pool.submit(fn, *args)
+    return pool.submit(contextvars.copy_context().run, fn, *args)
+
+def resolve_answers(name, types=DEFAULT_TYPES):
+    # Every type after the first is resolved in parallel on the type pool
+    futures = [submit(type_pool, lookup, name, rtype) for rtype in types[1:]]
+    return [lookup(name, types[0])] + [f.result() for f in futures]
+
+def resolve_domain(name, types=DEFAULT_TYPES):
+    try:
+        return answer_result(name, resolve_answers(name, types))
+    except resolver.ResolverError as e:
+        return {'domain': name, 'error': str(e)}
+
+def resolve_many(fn, items, window):
+    # Keeps at most `window` lookups in flight and yields results as they finish
+    items = iter(items)
+    pending = set()
+    while True:
+        for item in items:
+            pending.add(submit(batch_pool, fn, item))
+            if len(pending) >= window:
+                break
+        if not pending:
+            return
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield future.result()
+
+def parse_types(values):
+    types = tuple(dict.fromkeys(t.strip().upper() for v in values for t in v.split(',') if t.strip()))
+    unknown = [t for t in types if t not in resolver.QTYPES]
+    if unknown:
+        raise ValueError('unsupported record type %s (choose from %s)'
+                         % (', '.join(unknown), ', '.join(resolver.QTYPES)))
+    return types or DEFAULT_TYPES
+
+def request_types(values):
+    try:
+        return parse_types(values)
+    except ValueError as e:
+        abort(400, str(e))
+
+def request_domain(value):
+    # Validated and normalised before any backend, cache or socket sees it
+    start = time.perf_counter()
+    try:
+        return resolver.normalize_name(value)
+    except ValueError as e:
+        abort(400, str(e))
+    finally:
+        stage_done('validate', start)
+
+def render_text(result):
+    if 'error' in result:
+        return result['error']
+    return ''.join('%(name)s\t%(ttl)d\tIN\t%(type)s\t%(data)s\n' % r for r in result['records'])
+
+def answer_etag(result, fmt):
+    # Weak validator over the answer set, not TTLs: the TTLs in the body count
+    # down between requests while the answer itself is unchanged. Gzipped and
+    # plain bodies are equivalent, so it is known before anything is rendered
+    records = sorted((r['name'], r['type'], r['data']) for r in result['records'])
+    return hashlib.blake2b(repr((fmt, records)).encode(), digest_size=16).hexdigest()
+
+def cache_headers(result, fmt):
+    """Return (etag, headers) for a cacheable result, else (None, no-store headers)."""
+    if 'error' in result:
+        return None, {'Cache-Control': 'no-store'}
+    max_age = min((r['ttl'] for r in result['records']), default=0)
+    etag = answer_etag(result, fmt)
+    return etag, {'Cache-Control': 'max-age=%d' % max_age, 'ETag': 'W/"%s"' % etag,
+                  'Vary': 'Accept, Accept-Encoding'}
+
+def render(result, fmt, encoding, validators=None):
+    """Return (etag, body, headers) for a single-domain result.
+
+    `validators` is the (etag, headers) pair from cache_headers() when the
+    caller already has it.
+    """
+    if fmt == 'json':
+        body = json.dumps(result).encode()
+    else:
+        # Names and TXT/CAA strings come from whoever runs the zone
+        body = f"<pre>{html.escape(render_text(result))}</pre>".encode()
+    if encoding == 'gzip' and len(body) >= app.config['DNS_GZIP_MIN_SIZE']:
+        body = gzip.compress(body, mtime=0)
+    else:
+        encoding = 'identity'
+    etag, headers = validators or cache_headers(result, fmt)
+    headers['Content-Type'] = CONTENT_TYPES[fmt]
+    if encoding == 'gzip':
+        headers['Content-Encoding'] = 'gzip'
+    return etag, body, headers
+
+def rendered_answers(name, types, fmt, encoding, answers, not_modified=None):
+    """Return (etag, body, headers) for resolved answers.
+
+    When `not_modified(etag)` is true the body is None and nothing is
+    rendered, since the response will be a 304.
+    """
+    # Answers come back as the same tuples while cached, so the stored bytes are
+    # current for an equal list of the same age; bodies carry counted-down TTLs,
+    # so a hot name is rendered again at most once a second
+    start = time.perf_counter()
+    key = (name, types, fmt, encoding)
+    ages = tuple(answer_age(a) for a in answers)
+    cached = render_cache.get(key)
+    if cached is None or cached[0] != answers or cached[1] != ages:
+        result = answer_result(name, answers)
+        validators = cache_headers(result, fmt)
+        if not_modified is not None and not_modified(validators[0]):
+            validators[1]['Content-Type'] = CONTENT_TYPES[fmt]
+            stage_done('render', start)
+            return validators[0], None, validators[1]
+        # Plain tuples, so the per-lookup Answer wrappers are not kept alive
+        cached = [tuple(a) for a in answers], ages, render(result, fmt, encoding, validators)
+        render_cache.put(key, cached, min((r['ttl'] for r in result['records']), default=0))
+    stage_done('render', start)
+    return cached[2]
+
+def wants_json():
+    return request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json'
+
+def wants_ndjson():
+    return (request.args.get('stream') == '1' or
+            request.accept_mimetypes.best == 'application/x-ndjson')
+
+def ndjson_response(results):
+    def lines():
+        for result in results:
+            if 'records' in result:
+                for record in result['records']:
+                    yield json.dumps(dict(record, domain=result['domain'])) + '\n'
+            else:
+                yield json.dumps(result) + '\n'
+    return Response(lines(), mimetype='application/x-ndjson')
+
+def batch_domains():
+    body = request.get_json(silent=True)
+    domains = body.get('domains') if isinstance(body, dict) else None
+    if not isinstance(domains, list) or not all(isinstance(d, str) for d in domains):
+        abort(400, 'expected a JSON body of the form {"domains": [...]}')
+    if len(domains) > app.config['DNS_BATCH_MAX']:
+        abort(413, 'at most %d domains per batch' % app.config['DNS_BATCH_MAX'])
+    types = body.get('types', [])
+    if not isinstance(types, list) or not all(isinstance(t, str) for t in types):
+        abort(400, '"types" must be a list of record types')
+    types = request_types(types)
+    start = time.perf_counter()
+    entries = list(dict.fromkeys(batch_entry(d) for d in domains))
+    stage_done('validate', start)
+    return entries, types
+
+def batch_entry(value):
+    # (name, None) for a valid name, else (value, error): one bad name is
+    # reported on its own line instead of failing the whole batch
+    try:
+        return resolver.normalize_name(value), None
+    except ValueError as e:
+        return value, str(e)
+
+def resolve_entry(entry, types):
+    name, error = entry
+    if error is not None:
+        return {'domain': name, 'error': error}
+    return resolve_domain(name, types)
+
+if app.config['DNS_SNAPSHOT_PATH']:
+    if os.path.exists(app.config['DNS_SNAPSHOT_PATH']):
+        snapshot_reader = open_snapshot(app.config['DNS_SNAPSHOT_PATH'])
+    threading.Thread(target=snapshot_loop, name='dns-snapshot', daemon=True).start()
+    atexit.register(save_snapshot)
+
+def overloaded_response(e):
+    return Response(str(e), 503, {'Retry-After': str(app.config['DNS_RETRY_AFTER'])},
+                    mimetype='text/plain')
+
+def client_id(api_key, address, forwarded_for):
+    # Only configured keys count: made-up ones would each get a fresh bucket
+    # and push real clients out of the limiter's LRU
+    if api_key in api_clients:
+        return api_clients[api_key]
+    hops = app.config['DNS_PROXY_HOPS']
+    if hops and forwarded_for:
+        # Each proxy appends the address it was connected from, so the entry
+        # `hops` from the end is the first one a client cannot forge
+        chain = forwarded_for.split(',')
+        if len(chain) >= hops:
+            return chain[-hops].strip()
+    return address
+
+def throttle_delay(client):
+    if app.config['DNS_RATE_LIMIT'] <= 0:
+        return 0
+    return rate_limiter.allow(client)
+
+def throttled_response(delay):
+    return Response('rate limit exceeded', 429, {'Retry-After': str(math.ceil(delay))},
+                    mimetype='text/plain')
+
+def wants_timing():
+    # Checked on every request, so the raw environ is read first: a miss through
+    # request.headers raises a KeyError and request.args goes through a proxy
+    environ = request.environ
+    return ('HTTP_X_SERVER_TIMING' in environ or
+            'timing=' in environ.get('QUERY_STRING', '') and request.args.get('timing') == '1')
+
+def timed(view):
+    # Counts and times every request, including refused and rejected ones, and
+    # adds a Server-Timing header when the request asks for one
+    endpoint = view.__name__
+    observe = request_seconds.labels(endpoint).observe
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        token = request_timings.set([]) if wants_timing() else None
+        status = 500
+        try:
+            response = app.make_response(view(*args, **kwargs))
+            status = response.status_code
+            if token is not None:
+                response.headers['Server-Timing'] = server_timing(request_timings.get(),
+                                                                  time.perf_counter() - start)
+            return response
+        except HTTPException as e:
+            status = e.code
+            raise
+        finally:
+            if token is not None:
+                request_timings.reset(token)
+            request_counts.inc((endpoint, status))
+            observe(time.perf_counter() - start)
+    return wrapper
+
+def admitted(view):
+    # Rate limiting and admission both happen before any resolution work
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        delay = throttle_delay(client_id(request.headers.get('X-API-Key'), request.remote_addr,
+                                         request.headers.get('X-Forwarded-For')))
+        if delay:
+            return throttled_response(delay)
+        try:
+            admission.acquire()
+        except Overloaded as e:
+            return overloaded_response(e)
+        try:
+            response = app.make_response(view(*args, **kwargs))
+        except BaseException:
+            admission.release()
+            raise
+        # Streamed responses keep their slot until the body has been sent
+        response.call_on_close(admission.release)
+        return response
+    return wrapper
 
 @app.route('/dns-lookup')
+@timed
+@admitted
 def dns_lookup():
-    domain_name = request.args.get('domain')
+    domain_name = request_domain(request.args.get('domain', ''))
+    types = request_types(request.args.getlist('type'))
+
+    if wants_ndjson():
+        return ndjson_response(resolve_many(lambda t: resolve_domain(domain_name, (t,)),
+                                            types, len(types)))
+
+    fmt = 'json' if wants_json() else 'html'
+    encoding = 'gzip' if request.accept_encodings['gzip'] else 'identity'
+    try:
+        answers = resolve_answers(domain_name, types)
+    except resolver.ResolverError as e:
+        etag, body, headers = render({'domain': domain_name, 'error': str(e)}, fmt, encoding)
+    else:
+        etag, body, headers = rendered_answers(domain_name, types, fmt, encoding, answers,
+                                               request.if_none_match.contains_weak)
+    if etag is not None and request.if_none_match.contains_weak(etag):
+        return Response(status=304, headers=headers)
+    return Response(body, headers=headers)
+
+@app.route('/dns-lookup/batch', methods=['POST'])
+@timed
+@admitted
+def dns_lookup_batch():
+    entries, types = batch_domains()
+    results = resolve_many(lambda e: resolve_entry(e, types), entries,
+                           app.config['DNS_BATCH_WINDOW'])
+    if wants_ndjson():
+        return ndjson_response(results)
+    return jsonify(results=list(results))
+
+@app.route('/dns-lookup/stats')
+def dns_lookup_stats():
+    return jsonify(cache=answer_cache.stats(), negative_cache=negative_cache.stats(),
+                   singleflight=flight.stats(), backend=backend.stats(),
+                   admission=admission.stats(), async_admission=async_admission.stats(),
+                   rate_limit=rate_limiter.stats(), render_cache=render_cache.stats(),
+                   snapshot_hits=snapshot_reader.hits if snapshot_reader is not None else 0,
+                   shared_cache=shared_cache.stats() if shared_cache is not None else None)
+
+def metrics_text():
+    caches = {'answer': answer_cache.stats(), 'negative': negative_cache.stats(),
+              'render': render_cache.stats()}
+    if shared_cache is not None:
+        caches['shared'] = shared_cache.stats()
+    hits = [((name,), stats['hits']) for name, stats in caches.items()]
+    if snapshot_reader is not None:
+        hits.append((('snapshot',), snapshot_reader.hits))
+    pools = {'admission': admission.stats(), 'async_admission': async_admission.stats()}
+    backend_stats = backend.stats()
+    kind = app.config['DNS_BACKEND']
+
+    lines = request_counts.exposition() + request_seconds.exposition() + stage_seconds.exposition()
+    lines += metric_lines('dns_cache_hits_total', 'counter', 'Cache hits', ('cache',), hits)
+    lines += metric_lines('dns_cache_misses_total', 'counter', 'Cache misses', ('cache',),
+                          [((name,), stats['misses']) for name, stats in caches.items()])
+    lines += metric_lines('dns_cache_hit_ratio', 'gauge', 'Cache hits over lookups', ('cache',),
+                          [((name,), stats['hits'] / ((stats['hits'] + stats['misses']) or 1))
+                           for name, stats in caches.items()])
+    lines += metric_lines('dns_cache_entries', 'gauge', 'Entries held in memory', ('cache',),
+                          [((name,), stats['size']) for name, stats in caches.items() if 'size' in stats])
+    lines += metric_lines('dns_cache_prefetches_total', 'counter', 'Background refreshes of hot entries',
+                          (), [((), caches['answer']['prefetches'])])
+    lines += metric_lines('dns_cache_stale_answers_total', 'counter', 'Expired answers served',
+                          (), [((), caches['answer']['stale_hits'])])
+    lines += metric_lines('dns_in_flight', 'gauge', 'Requests or upstream lookups in progress', ('pool',),
+                          [((name,), stats['active']) for name, stats in pools.items()]
+                          + [(('singleflight',), flight.stats()['in_flight'])])
+    lines += metric_lines('dns_admission_queue_depth', 'gauge', 'Requests waiting for a slot', ('pool',),
+                          [((name,), stats['queue_depth']) for name, stats in pools.items()])
+    lines += metric_lines('dns_admission_rejected_total', 'counter', 'Requests refused with 503',
+                          ('pool',), [((name,), stats['rejected'] + stats['timed_out'])
+                                      for name, stats in pools.items()])
+    lines += metric_lines('dns_rate_limited_total', 'counter', 'Requests refused with 429',
+                          (), [((), rate_limiter.throttled)])
+    if 'spawned' in backend_stats:
+        lines += metric_lines('dns_subprocess_spawned_total', 'counter', 'nslookup processes started',
+                              ('backend',), [((kind,), backend_stats['spawned'])])
+    if 'restarts' in backend_stats:
+        lines += metric_lines('dns_subprocess_restarts_total', 'counter',
+                              'nslookup workers replaced after exiting or hanging',
+                              ('backend',), [((kind,), backend_stats['restarts'])])
+    return '\n'.join(lines) + '\n'
+
+@app.route('/metrics')
+def metrics():
+    return Response(metrics_text(), mimetype='text/plain; version=0.0.4')
+
+def admin_only(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        token = app.config['DNS_ADMIN_TOKEN']
+        if not token:
+            abort(404)
+        supplied = request.headers.get('Authorization', '').encode()
+        if not hmac.compare_digest(supplied, b'Bearer ' + token.encode()):
+            return Response('unauthorized', 401, {'WWW-Authenticate': 'Bearer'}, mimetype='text/plain')
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.route('/admin/profile')
+@admin_only
+def admin_profile():
+    # Samples every thread's stack for `seconds`; safe to run in production
+    # since nothing is traced and only one profile runs at a time
+    try:
+        seconds = float(request.args.get('seconds', 10))
+        interval = float(request.args.get('interval', 0.01))
+    except ValueError:
+        abort(400, 'seconds and interval must be numbers')
+    if not 0 < seconds <= app.config['DNS_PROFILE_MAX_SECONDS']:
+        abort(400, 'seconds must be above 0 and at most %g' % app.config['DNS_PROFILE_MAX_SECONDS'])
+    if not 0.001 <= interval <= 1:
+        abort(400, 'interval must be between 0.001 and 1 second')
+    fmt = request.args.get('format', 'collapsed')
+    if fmt not in ('collapsed', 'pstats'):
+        abort(400, 'format must be collapsed or pstats')
+    try:
+        samples = profiler.sample(seconds, interval)
+    except profiler.Busy as e:
+        return Response(str(e), 409, mimetype='text/plain')
+    if fmt == 'pstats':
+        return Response(profiler.pstats_dump(samples, interval), mimetype='application/octet-stream',
+                        headers={'Content-Disposition': 'attachment; filename=profile.pstats'})
+    return Response(profiler.collapsed(samples), mimetype='text/plain')
+
+async def resolve_answers_async(name, types=DEFAULT_TYPES):
+    return await asyncio.gather(*(lookup_async(name, rtype) for rtype in types))
+
+async def resolve_domain_async(name, types=DEFAULT_TYPES):
+    try:
+        return answer_result(name, await resolve_answers_async(name, types))
+    except resolver.ResolverError as e:
+        return {'domain': name, 'error': str(e)}
+
+asgi_lookup_seconds = request_seconds.labels('dns_lookup').observe
+
+async def asgi_app(scope, receive, send):
+    # Async serving mode: each lookup awaits on the event loop instead of
+    # holding a worker thread, so one process can keep many lookups in flight
+    if scope['type'] == 'lifespan':
+        while (await receive())['type'] != 'lifespan.shutdown':
+            await send({'type': 'lifespan.startup.complete'})
+        await send({'type': 'lifespan.shutdown.complete'})
+        return
+
+    start = time.perf_counter()
+    args = parse_qs(scope['query_string'].decode('latin-1'))
+    request_headers = dict(scope['headers'])
+    timings = token = None
+    if b'x-server-timing' in request_headers or args.get('timing') == ['1']:
+        timings = []
+        token = request_timings.set(timings)
+    types = None
+    if scope['path'] == '/dns-lookup':
+        try:
+            types = parse_types(args.get('type', []))
+            name = resolver.normalize_name(args.get('domain', [''])[0])
+        except ValueError as e:
+            error = str(e)
+        stage_done('validate', start)
 
-    # VULNERABLE: User input is passed to a system command
-    command = "nslookup " + domain_name
-    result = os.popen(command).read()
+    headers = []
+    client = client_id(request_headers.get(b'x-api-key', b'').decode('latin-1'),
+                       (scope.get('client') or ('',))[0],
+                       request_headers.get(b'x-forwarded-for', b'').decode('latin-1'))
+    delay = throttle_delay(client) if scope['path'] == '/dns-lookup' else 0
+    if scope['path'] == '/metrics':
+        status, content_type, body = 200, b'text/plain; version=0.0.4', metrics_text().encode()
+    elif scope['path'] != '/dns-lookup':
+        status, content_type, body = 404, b'text/plain; charset=utf-8', b'Not Found'
+    elif delay:
+        status, content_type, body = 429, b'text/plain; charset=utf-8', b'rate limit exceeded'
+        headers.append((b'retry-after', str(math.ceil(delay)).encode()))
+    elif types is None:
+        status, content_type, body = 400, b'text/plain; charset=utf-8', error.encode()
+    else:
+        try:
+            async_admission.acquire()
+        except Overloaded as e:
+            status, content_type, body = 503, b'text/plain; charset=utf-8', str(e).encode()
+            headers.append((b'retry-after', str(app.config['DNS_RETRY_AFTER']).encode()))
+        else:
+            accept = request_headers.get(b'accept', b'')
+            fmt = 'json' if b'application/json' in accept and b'text/html' not in accept else 'html'
+            encoding = 'gzip' if b'gzip' in request_headers.get(b'accept-encoding', b'') else 'identity'
+            if_none_match = parse_etags(request_headers.get(b'if-none-match', b'').decode('latin-1'))
+            try:
+                answers = await resolve_answers_async(name, types)
+            except resolver.ResolverError as e:
+                etag, body, rendered = render({'domain': name, 'error': str(e)}, fmt, encoding)
+            else:
+                etag, body, rendered = rendered_answers(name, types, fmt, encoding, answers,
+                                                        if_none_match.contains_weak)
+            finally:
+                async_admission.release()
+            status = 200
+            content_type = rendered['Content-Type'].encode()
+            headers += [(k.lower().encode(), v.encode()) for k, v in rendered.items() if k != 'Content-Type']
+            if etag is not None and if_none_match.contains_weak(etag):
+                status, body = 304, b''
 
-    return f"<pre>{result}</pre>"
+    if scope['path'] == '/dns-lookup':
+        request_counts.inc(('dns_lookup', status))
+        asgi_lookup_seconds(time.perf_counter() - start)
+    if token is not None:
+        request_timings.reset(token)
+        headers.append((b'server-timing', server_timing(timings, time.perf_counter() - start).encode()))
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', content_type)] + headers})
+    await send({'type': 'http.response.body', 'body': body})
 
 if __name__ == '__main__':
-    app.run()
\ No newline at end of file
+    if '--asgi' in sys.argv:
+        # uvicorn is only needed for --asgi, so it is not in requirements.txt
+        try:
+            import uvicorn
+        except ImportError:
+            sys.exit('--asgi needs an ASGI server: pip install uvicorn')
+        uvicorn.run(asgi_app)
+    else:
+        app.run()
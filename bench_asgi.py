@@ -0,0 +1,92 @@
+"""Find the concurrency ceiling of the ASGI serving mode.
+
+    python bench_asgi.py [--levels 1,16,...] [--requests N] [--delay SECONDS]
+
+app.asgi_app runs in this process on one event loop, as under uvicorn with
+one worker, against the stub from bench_backends. The stub answers every
+query --delay seconds late to stand in for upstream latency. At each level
+that many /dns-lookup requests for distinct names are kept in flight, and
+the run reports throughput, p50/p99 latency, how many requests were shed
+with 503 and how many failed (mostly upstream timeouts once the stub's
+socket buffer overflows). Throughput grows with concurrency until the
+loop's CPU or DNS_ASYNC_MAX_INFLIGHT caps it; that cap is the ceiling.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import time
+
+from bench_backends import percentile, start_stub
+
+
+async def get(asgi_app, path, query):
+    scope = {'type': 'http', 'path': path, 'query_string': query, 'client': ('127.0.0.1', 0),
+             'headers': [(b'accept', b'application/json')]}
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b''}
+
+    async def send(message):
+        messages.append(message)
+
+    await asgi_app(scope, receive, send)
+    status = messages[0]['status']
+    # Failed lookups are reported in a 200 body
+    if status == 200 and json.loads(messages[1]['body']).get('error'):
+        return None
+    return status
+
+
+async def run(asgi_app, level, requests, run_id):
+    names = iter('l%d-%d.example.com' % (run_id, i) for i in range(requests))
+    latencies = []
+    statuses = []
+
+    async def client():
+        for name in names:
+            start = time.perf_counter()
+            statuses.append(await get(asgi_app, '/dns-lookup', b'type=A&domain=' + name.encode()))
+            latencies.append(time.perf_counter() - start)
+
+    wall = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(level)))
+    wall = time.perf_counter() - wall
+    latencies.sort()
+    return {'rps': requests / wall, 'p50': percentile(latencies, 0.5),
+            'p99': percentile(latencies, 0.99), 'shed': statuses.count(503),
+            'errors': len(statuses) - statuses.count(200) - statuses.count(503)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--levels', default='1,16,64,256,1024,4096')
+    parser.add_argument('--requests', type=int, default=4096, help='per level')
+    parser.add_argument('--delay', type=float, default=0.05, help='upstream latency in seconds')
+    args = parser.parse_args()
+
+    stub, port = start_stub(args.delay)
+    # app reads its configuration when first imported
+    os.environ.update(DNS_SERVER='127.0.0.1', DNS_PORT=str(port), DNS_RATE_LIMIT='0')
+    import app
+
+    run_ids = itertools.count()
+    try:
+        print('%12s %10s %10s %10s %8s %8s' % ('concurrency', 'req/s', 'p50 ms', 'p99 ms', '503s', 'errors'))
+        best = None
+        for level in map(int, args.levels.split(',')):
+            result = asyncio.run(run(app.asgi_app, level, max(args.requests, level), next(run_ids)))
+            print('%12d %10.0f %10.3f %10.3f %8d %8d' % (
+                level, result['rps'], result['p50'] * 1e3, result['p99'] * 1e3, result['shed'],
+                result['errors']))
+            if best is None or result['rps'] > best[1]:
+                best = level, result['rps']
+        print('ceiling: %.0f req/s at concurrency %d' % best[::-1])
+    finally:
+        stub.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""Compare the DNS backends against one local stub server.
+
+    python bench_backends.py [--queries N] [--concurrency C] [--backends a,b]
+
+Every backend resolves the same A questions against a UDP stub running in a
+separate process, so neither network latency nor the stub's own CPU shows
+up in the numbers. For each backend it reports p50/p99 latency, throughput
+and the CPU time (user + system, this process plus the nslookup processes it
+spawned) spent per query. getaddrinfo cannot be pointed at a server and asks
+the system resolver instead, so it only runs when named in --backends.
+"""
+import argparse
+import collections
+import multiprocessing
+import resource
+import select
+import socket
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import resolver
+
+
+def serve(sock, delay=0):
+    """Answer every question with one A record, `delay` seconds after it arrives."""
+    pending = collections.deque()
+    while True:
+        while pending and pending[0][0] <= time.monotonic():
+            sock.sendto(*pending.popleft()[1:])
+        if pending and not select.select([sock], [], [], max(0, pending[0][0] - time.monotonic()))[0]:
+            continue
+        packet, peer = sock.recvfrom(4096)
+        try:
+            offset = resolver.read_name(memoryview(packet), 12)[1]
+        except resolver.ResolverError:
+            continue
+        question = packet[12:offset + 4]
+        answer = b'\xc0\x0c' + struct.pack('!HHIH', 1, 1, 300, 4) + bytes([10, 0, 0, 1])
+        reply = packet[:2] + struct.pack('!HHHHH', 0x8180, 1, 1, 0, 0) + question + answer
+        if delay:
+            pending.append((time.monotonic() + delay, reply, peer))
+        else:
+            sock.sendto(reply, peer)
+
+
+def start_stub(delay=0):
+    """Run serve() in a forked process; returns the process and its UDP port."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    stub = multiprocessing.get_context('fork').Process(target=serve, args=(sock, delay), daemon=True)
+    stub.start()
+    port = sock.getsockname()[1]
+    sock.close()
+    return stub, port
+
+
+def cpu_seconds():
+    usage = [resource.getrusage(who) for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)]
+    return sum(u.ru_utime + u.ru_stime for u in usage)
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def run(kind, port, queries, concurrency):
+    backend = resolver.make_backend(kind, server='127.0.0.1', port=port, workers=concurrency)
+    names = ['host%d.example.com' % i for i in range(queries)]
+    errors = []
+
+    def timed(name):
+        start = time.perf_counter()
+        try:
+            backend.query(name, 'A')
+        except resolver.ResolverError as e:
+            errors.append(e)
+        return time.perf_counter() - start
+
+    try:
+        with ThreadPoolExecutor(concurrency) as pool:
+            list(pool.map(timed, names[:concurrency]))
+            del errors[:]
+            cpu, wall = cpu_seconds(), time.perf_counter()
+            latencies = sorted(pool.map(timed, names))
+            wall = time.perf_counter() - wall
+    finally:
+        backend.close()
+    # Pooled nslookup processes are only charged to RUSAGE_CHILDREN once closed
+    cpu = cpu_seconds() - cpu
+    return {'errors': len(errors), 'first_error': errors[0] if errors else None,
+            'p50': percentile(latencies, 0.5), 'p99': percentile(latencies, 0.99),
+            'qps': queries / wall, 'cpu': cpu / queries}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--backends', default='native,subprocess,nslookup-pool',
+                        help='comma-separated, from: %s' % ', '.join(sorted(resolver.BACKENDS)))
+    args = parser.parse_args()
+
+    stub, port = start_stub()
+    try:
+        print('%-14s %8s %10s %10s %10s %14s' % ('backend', 'errors', 'p50 ms', 'p99 ms', 'q/s', 'cpu ms/query'))
+        for kind in args.backends.split(','):
+            result = run(kind, port, args.queries, args.concurrency)
+            print('%-14s %8d %10.3f %10.3f %10.0f %14.3f' % (
+                kind, result['errors'], result['p50'] * 1e3, result['p99'] * 1e3, result['qps'],
+                result['cpu'] * 1e3))
+            if result['first_error']:
+                print('    first error: %s' % result['first_error'])
+    finally:
+        stub.terminate()
+
+
+if __name__ == '__main__':
+    main()
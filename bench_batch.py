@@ -0,0 +1,70 @@
+"""Measure /dns-lookup/batch throughput against batch size.
+
+    python bench_batch.py [--sizes 1,10,...] [--domains N] [--delay SECONDS] [--window W]
+
+Posts batches of distinct names through the Flask test client, so no HTTP
+server is involved, to the stub from bench_backends answering --delay
+seconds late. For each batch size it sends batches, one at a time, until
+--domains names have been resolved. It reports domains resolved per
+second, p50/p99 batch latency and failed names. With W lookups pipelined
+per batch (DNS_BATCH_WINDOW), throughput should rise with batch size until
+it nears W / delay.
+"""
+import argparse
+import itertools
+import os
+import time
+
+from bench_backends import percentile, start_stub
+
+
+def run(client, size, domains, run_id):
+    names = ('b%d-%d.example.com' % (run_id, i) for i in range(max(domains, size)))
+    latencies = []
+    errors = resolved = 0
+    wall = time.perf_counter()
+    while True:
+        batch = list(itertools.islice(names, size))
+        if not batch:
+            break
+        start = time.perf_counter()
+        with client.post('/dns-lookup/batch', json={'domains': batch, 'types': ['A']}) as response:
+            results = response.json['results']
+        latencies.append(time.perf_counter() - start)
+        errors += sum('error' in r for r in results)
+        resolved += len(results)
+    wall = time.perf_counter() - wall
+    latencies.sort()
+    return {'dps': resolved / wall, 'p50': percentile(latencies, 0.5),
+            'p99': percentile(latencies, 0.99), 'errors': errors}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--sizes', default='1,10,100,1000,10000')
+    parser.add_argument('--domains', type=int, default=10000, help='per batch size')
+    parser.add_argument('--delay', type=float, default=0.01, help='upstream latency in seconds')
+    parser.add_argument('--window', type=int, help='DNS_BATCH_WINDOW (default: the app default)')
+    args = parser.parse_args()
+
+    stub, port = start_stub(args.delay)
+    # app reads its configuration when first imported
+    os.environ.update(DNS_SERVER='127.0.0.1', DNS_PORT=str(port), DNS_RATE_LIMIT='0')
+    if args.window:
+        os.environ['DNS_BATCH_WINDOW'] = str(args.window)
+    import app
+
+    client = app.app.test_client()
+    try:
+        print('window %d, upstream delay %.0f ms' % (app.app.config['DNS_BATCH_WINDOW'], args.delay * 1e3))
+        print('%10s %12s %14s %14s %8s' % ('batch', 'domains/s', 'p50 batch ms', 'p99 batch ms', 'errors'))
+        for run_id, size in enumerate(map(int, args.sizes.split(','))):
+            result = run(client, size, args.domains, run_id)
+            print('%10d %12.0f %14.3f %14.3f %8d' % (
+                size, result['dps'], result['p50'] * 1e3, result['p99'] * 1e3, result['errors']))
+    finally:
+        stub.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Measure the memory each cached answer takes in AnswerCache.
+
+    python bench_cache_memory.py [--entries N]
+
+Fills an AnswerCache with N distinct names per answer shape. Each name is
+stored the way app.store_answer() stores it: an interned cache key and a
+tuple of resolver.Record values. tracemalloc then reports the bytes per
+answer. That figure covers everything the entry keeps alive: the name,
+the key, the LRU slot, the entry and its records. For comparison, the
+same answers are also held as lists of as_dict() dicts, the plain JSON
+form.
+"""
+import argparse
+import sys
+import tracemalloc
+
+import resolver
+from cache import AnswerCache
+
+SHAPES = {
+    'A x1': [('A', '93.184.216.34')],
+    'A x4': [('A', '93.184.216.%d' % i) for i in range(4)],
+    'AAAA x2': [('AAAA', '2606:2800:220:1:248:1893:25c8:%x' % i) for i in range(2)],
+    'CNAME + A': [('CNAME', 'edge.example.net'), ('A', '93.184.216.34')],
+    'MX x2': [('MX', '10 mx%d.example.com' % i) for i in range(2)],
+    'TXT': [('TXT', '"v=spf1 include:_spf.example.com -all"')],
+}
+
+
+def measure(fill, entries):
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        kept = fill(entries)
+        used = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del kept
+    return used / entries
+
+
+def fill_cache(shape):
+    def fill(entries):
+        cache = AnswerCache(entries)
+        for i in range(entries):
+            name = sys.intern('host%d.example.com' % i)
+            records = tuple(resolver.Record.from_text(name, rtype, 300, data) for rtype, data in shape)
+            cache.put((name, shape[-1][0]), records, 300)
+        return cache
+    return fill
+
+
+def fill_dicts(shape):
+    def fill(entries):
+        return {('host%d.example.com' % i, shape[-1][0]):
+                [{'name': 'host%d.example.com' % i, 'type': rtype, 'ttl': 300, 'data': data}
+                 for rtype, data in shape] for i in range(entries)}
+    return fill
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--entries', type=int, default=100000)
+    args = parser.parse_args()
+
+    print('%-12s %14s %14s' % ('answer', 'cache B/entry', 'dicts B/entry'))
+    for label, shape in SHAPES.items():
+        print('%-12s %14.0f %14.0f' % (label, measure(fill_cache(shape), args.entries),
+                                       measure(fill_dicts(shape), args.entries)))
+
+
+if __name__ == '__main__':
+    main()
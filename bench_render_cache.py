@@ -0,0 +1,61 @@
+"""Measure requests per second for one hot /dns-lookup key.
+
+    python bench_render_cache.py [--requests N] [--records N]
+
+A hot name with --records A records is put in the answer cache, so no
+upstream query is made. It is then requested repeatedly through the Flask
+test client as JSON and as HTML, plain and gzipped. Each combination runs
+with the rendered-response cache on and with it off (a zero-size cache),
+and finally as revalidations answered 304. The difference between the
+on and off columns is what pre-rendering saves on a hot key.
+"""
+import argparse
+import os
+import time
+
+HOT = 'hot.example.com'
+
+
+def rate(client, requests, headers):
+    path = '/dns-lookup?type=A&domain=' + HOT
+    start = time.perf_counter()
+    for _ in range(requests):
+        with client.get(path, headers=headers) as response:
+            response.get_data()
+    return requests / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--records', type=int, default=8)
+    args = parser.parse_args()
+
+    # app reads its configuration when first imported; nothing is sent upstream
+    os.environ.update(DNS_SERVER='127.0.0.1', DNS_RATE_LIMIT='0')
+    import app
+    import resolver
+    from cache import AnswerCache
+
+    records = tuple(resolver.Record(HOT, 1, 3600, 0x5db8d800 + i) for i in range(args.records))
+    app.answer_cache.put(app.cache_key(HOT, 'A'), records, 3600)
+    client = app.app.test_client()
+    render_cache = app.render_cache
+    print('%-6s %-9s %14s %14s' % ('format', 'encoding', 'cached req/s', 'uncached req/s'))
+    for fmt, accept in (('json', 'application/json'), ('html', 'text/html')):
+        for encoding in ('identity', 'gzip'):
+            headers = {'Accept': accept, 'Accept-Encoding': encoding}
+            rates = []
+            for cache in (render_cache, AnswerCache(0)):
+                app.render_cache = cache
+                rates.append(rate(client, args.requests, headers))
+            app.render_cache = render_cache
+            print('%-6s %-9s %14.0f %14.0f' % (fmt, encoding, rates[0], rates[1]))
+    with client.get('/dns-lookup?type=A&domain=' + HOT, headers={'Accept': 'application/json'}) as response:
+        etag = response.headers['ETag']
+    print('304s: %.0f req/s' % rate(client, args.requests, {'Accept': 'application/json',
+                                                           'If-None-Match': etag}))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""Measure 1, 4 and 16 worker processes sharing one SharedAnswerCache.
+
+    python bench_shared_cache.py [--workers 1,4,16] [--requests N] [--names N] [--local N]
+
+Each worker looks names up the way app.cached_answer() does. It checks
+its own AnswerCache first and then the shared table. On a miss in both it
+resolves the name against the stub from bench_backends and stores the
+answer in both caches. Names are drawn with a Zipf-like skew from
+--names names. For each worker count the run is done with the table
+shared and again without it. The output compares lookups/s over all
+workers, shared hit rate and upstream queries. Upstream queries are what
+sharing saves: without the table every worker resolves every name itself.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+import resolver
+from bench_backends import start_stub
+from cache import AnswerCache
+from shared_cache import SharedAnswerCache
+
+
+def work(worker, port, path, args, barrier, results):
+    shared = SharedAnswerCache(path, args.slots) if path else None
+    local = AnswerCache(args.local)
+    rng = random.Random(worker)
+    names = ['host%d.example.com' % i for i in range(args.names)]
+    weights = [1 / (i + 1) for i in range(args.names)]
+    keys = [(name, 'A') for name in rng.choices(names, weights, k=args.requests)]
+    upstream = 0
+    barrier.wait()
+    start = time.perf_counter()
+    for key in keys:
+        if local.get(key) is not None:
+            continue
+        if shared is not None:
+            loaded = shared.get(key)
+            if loaded is not None:
+                local.put(key, loaded[0], loaded[1])
+                continue
+        _, records, _ = resolver.query(key[0], 1, '127.0.0.1', port)
+        upstream += 1
+        local.put(key, tuple(records), 300)
+        if shared is not None:
+            shared.put(key, records, 300)
+    results.put((time.perf_counter() - start, upstream, shared.hits if shared else 0,
+                 shared.misses if shared else 0))
+
+
+def run(workers, port, path, args):
+    context = multiprocessing.get_context('fork')
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    processes = [context.Process(target=work, args=(i, port, path, args, barrier, results))
+                 for i in range(workers)]
+    for p in processes:
+        p.start()
+    collected = [results.get() for _ in processes]
+    for p in processes:
+        p.join()
+    wall = max(r[0] for r in collected)
+    hits, misses = sum(r[2] for r in collected), sum(r[3] for r in collected)
+    return {'lps': workers * args.requests / wall, 'upstream': sum(r[1] for r in collected),
+            'hit_rate': hits / (hits + misses) if hits + misses else 0.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--workers', default='1,4,16')
+    parser.add_argument('--requests', type=int, default=20000, help='per worker')
+    parser.add_argument('--names', type=int, default=20000)
+    parser.add_argument('--local', type=int, default=1000, help='per-worker AnswerCache size')
+    parser.add_argument('--slots', type=int, default=65536, help='shared table slots')
+    args = parser.parse_args()
+
+    stub, port = start_stub()
+    directory = tempfile.TemporaryDirectory(dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+    try:
+        print('%8s %8s %12s %10s %10s' % ('workers', 'shared', 'lookups/s', 'shm hits', 'upstream'))
+        for workers in map(int, args.workers.split(',')):
+            for share in (True, False):
+                path = os.path.join(directory.name, 'answers-%d' % workers) if share else None
+                result = run(workers, port, path, args)
+                print('%8d %8s %12.0f %9.1f%% %10d' % (
+                    workers, 'yes' if share else 'no', result['lps'], result['hit_rate'] * 100,
+                    result['upstream']))
+    finally:
+        directory.cleanup()
+        stub.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Measure snapshot write and warm-start times at a given cache size.
+
+    python bench_snapshot.py [--entries N] [--lookups N] [--path FILE]
+
+Writes a snapshot of N one-record A answers and then times three ways of
+using it. The first is opening it as the app does at startup. The second
+is lookups of random keys through the mmap, which is how the lazy warm
+start serves misses. The third is walking every entry into an AnswerCache,
+which is what an eager load would cost. The file was just written, so it
+is read from the page cache. A cold start after a reboot also pays for
+the disk reads on the pages a lookup touches.
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import resolver
+import snapshot
+from bench_backends import percentile
+from cache import AnswerCache
+
+
+def entries(count, expires):
+    for i in range(count):
+        name = 'host%d.example.com' % i
+        yield (name, 'A'), (resolver.Record(name, 1, 300, i),), expires
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--entries', type=int, default=1000000)
+    parser.add_argument('--lookups', type=int, default=10000)
+    parser.add_argument('--path', help='snapshot file (default: a temporary file)')
+    args = parser.parse_args()
+
+    path = args.path
+    if path is None:
+        fd, path = tempfile.mkstemp(suffix='.snapshot')
+        os.close(fd)
+    try:
+        start = time.perf_counter()
+        snapshot.write_snapshot(path, entries(args.entries, time.time() + 3600))
+        print('write          %10.3f s  (%.1f MB)' % (time.perf_counter() - start, os.path.getsize(path) / 1e6))
+
+        start = time.perf_counter()
+        reader = snapshot.SnapshotReader(path)
+        print('open           %10.3f ms' % ((time.perf_counter() - start) * 1e3))
+        try:
+            latencies = []
+            for i in random.sample(range(args.entries), min(args.lookups, args.entries)):
+                start = time.perf_counter()
+                found = reader.get(('host%d.example.com' % i, 'A'))
+                latencies.append(time.perf_counter() - start)
+                if found is None:
+                    raise SystemExit('host%d.example.com missing from the snapshot' % i)
+            latencies.sort()
+            print('lookup p50     %10.3f us' % (percentile(latencies, 0.5) * 1e6))
+            print('lookup p99     %10.3f us' % (percentile(latencies, 0.99) * 1e6))
+
+            cache = AnswerCache(args.entries)
+            start = time.perf_counter()
+            now = time.time()
+            for key, records, expires in reader.entries():
+                cache.put(key, records, 300, 300 - (expires - now))
+            print('eager load     %10.3f s' % (time.perf_counter() - start))
+        finally:
+            reader.close()
+    finally:
+        if args.path is None:
+            os.unlink(path)
+
+
+if __name__ == '__main__':
+    main()
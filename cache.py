@@ -0,0 +1,176 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Entry:
+    __slots__ = ('expires', 'ttl', 'value', 'hits', 'refreshing', 'recheck')
+
+    def __init__(self, expires, ttl, value):
+        self.expires = expires
+        self.ttl = ttl
+        self.value = value
+        self.hits = 0
+        self.refreshing = False
+        self.recheck = 0.0
+
+
+class AnswerCache:
+    """In-memory LRU of resolved answers, each entry expiring after its TTL.
+
+    When `prefetch` is set, a hit on an entry that has been hit at least
+    `prefetch_min_hits` times and is within the last `prefetch_fraction` of its
+    TTL calls `prefetch(key)` once, so the caller can refresh it in the
+    background before it expires.
+
+    Expired entries are kept for a further `stale_ttl` seconds, during which
+    `get_stale` still returns them (RFC 8767 serve-stale). After
+    `refresh_failed` the entry is due for no new refresh attempt for
+    `stale_recheck` seconds (RFC 8767 section 5 failure recheck).
+    """
+
+    def __init__(self, maxsize=10000, prefetch=None, prefetch_fraction=0.1, prefetch_min_hits=2,
+                 stale_ttl=0, stale_recheck=30):
+        self.maxsize = maxsize
+        self.stale_ttl = stale_ttl
+        self.stale_recheck = stale_recheck
+        self.prefetch = prefetch
+        self.prefetch_fraction = prefetch_fraction
+        self.prefetch_min_hits = prefetch_min_hits
+        self.hits = 0
+        self.misses = 0
+        self.prefetches = 0
+        self.stale_hits = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        entry = self._get(key, time.monotonic())
+        return None if entry is None else entry.value
+
+    def get_aged(self, key):
+        """Return (value, seconds of its TTL already used) for a fresh entry, else None."""
+        now = time.monotonic()
+        entry = self._get(key, now)
+        return None if entry is None else (entry.value, entry.ttl - (entry.expires - now))
+
+    def _get(self, key, now):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.expires <= now:
+                if entry is not None and entry.expires + self.stale_ttl <= now:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            entry.hits += 1
+            refresh = (self.prefetch is not None and not entry.refreshing
+                       and entry.hits >= self.prefetch_min_hits
+                       and entry.expires - now <= entry.ttl * self.prefetch_fraction)
+            if refresh:
+                entry.refreshing = True
+                self.prefetches += 1
+        if refresh:
+            self.prefetch(key)
+        return entry
+
+    def get_stale(self, key):
+        """Return (value, recheck pending) for an entry in its stale window, else None."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.expires + self.stale_ttl <= now:
+                return None
+            return entry.value, entry.recheck > now
+
+    def refresh_failed(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.recheck = time.monotonic() + self.stale_recheck
+
+    def stale_served(self):
+        self.stale_hits += 1
+
+    def put(self, key, value, ttl, age=0):
+        """Store `value` for `ttl` seconds, `age` of which have already passed."""
+        if ttl - age <= 0 or self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = _Entry(time.monotonic() + ttl - age, ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        """Forget `key`, stale copy included."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def items(self):
+        """Return (key, value, seconds left) for every unexpired entry."""
+        now = time.monotonic()
+        with self._lock:
+            return [(key, entry.value, entry.expires - now)
+                    for key, entry in self._entries.items() if entry.expires > now]
+
+    def stats(self):
+        return {'size': len(self._entries), 'maxsize': self.maxsize,
+                'hits': self.hits, 'misses': self.misses, 'prefetches': self.prefetches,
+                'stale_hits': self.stale_hits}
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same key into one execution."""
+
+    def __init__(self):
+        self.coalesced = 0
+        self._calls = {}
+        self._tasks = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+        if leader:
+            try:
+                call.result = fn()
+            except Exception as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        else:
+            call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    async def do_async(self, key, fn):
+        task = self._tasks.get(key)
+        if task is None:
+            task = self._tasks[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def stats(self):
+        return {'in_flight': len(self._calls) + len(self._tasks), 'coalesced': self.coalesced}
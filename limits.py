@@ -0,0 +1,117 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class Overloaded(Exception):
+    pass
+
+
+class AdmissionController:
+    """Bounded concurrency limiter with a short, bounded wait queue.
+
+    Up to `limit` callers run at once; up to `queue_size` more wait at most
+    `queue_timeout` seconds for a slot. Anyone else is refused straight away
+    with Overloaded, so latency stays bounded instead of queues growing.
+    """
+
+    def __init__(self, limit, queue_size=0, queue_timeout=0.0):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.max_waiting = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            if self.active < self.limit:
+                self.active += 1
+                self.admitted += 1
+                return
+            if self.waiting >= self.queue_size:
+                self.rejected += 1
+                raise Overloaded('too many lookups in progress')
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+            start = time.monotonic()
+            admitted = self._cond.wait_for(lambda: self.active < self.limit, self.queue_timeout)
+            waited = time.monotonic() - start
+            self.waiting -= 1
+            self.wait_time += waited
+            self.max_wait_time = max(self.max_wait_time, waited)
+            if not admitted:
+                self.timed_out += 1
+                raise Overloaded('timed out waiting for a lookup slot')
+            self.active += 1
+            self.admitted += 1
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+    def stats(self):
+        return {'limit': self.limit, 'active': self.active, 'queue_depth': self.waiting,
+                'max_queue_depth': self.max_waiting, 'admitted': self.admitted,
+                'rejected': self.rejected, 'timed_out': self.timed_out,
+                'total_wait_seconds': self.wait_time, 'max_wait_seconds': self.max_wait_time}
+
+
+class _Bucket:
+    __slots__ = ('tokens', 'updated', 'throttled')
+
+    def __init__(self, tokens, updated):
+        self.tokens = tokens
+        self.updated = updated
+        self.throttled = 0
+
+
+class RateLimiter:
+    """Per-client token buckets refilled at `rate` per second up to `burst`.
+
+    Buckets live in an LRU bounded by `max_clients`; an evicted client simply
+    starts again with a full bucket, which is what an idle one would have.
+    """
+
+    def __init__(self, rate, burst, max_clients=100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.throttled = 0
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def allow(self, client):
+        """Take one token; return 0 if allowed, else seconds until one is available."""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                bucket = self._buckets[client] = _Bucket(self.burst, now)
+                if len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(client)
+                bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+                bucket.updated = now
+            if bucket.tokens >= 1:
+                bucket.tokens -= 1
+                return 0
+            bucket.throttled += 1
+            self.throttled += 1
+            return (1 - bucket.tokens) / self.rate
+
+    def stats(self, top=20):
+        with self._lock:
+            throttled = sorted(((b.throttled, c) for c, b in self._buckets.items() if b.throttled),
+                               reverse=True)[:top]
+            return {'rate': self.rate, 'burst': self.burst, 'clients': len(self._buckets),
+                    'throttled': self.throttled,
+                    'top_throttled': {client: count for count, client in throttled}}
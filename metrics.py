@@ -0,0 +1,102 @@
+import bisect
+import threading
+from collections import defaultdict
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (n, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                             for n, v in zip(names, values))
+
+
+def metric_lines(name, kind, help, label_names, samples):
+    """Prometheus text exposition for (label values, value) samples."""
+    lines = ['# HELP %s %s' % (name, help), '# TYPE %s %s' % (name, kind)]
+    for values, value in samples:
+        lines.append('%s%s %s' % (name, format_labels(label_names, values), repr(float(value))))
+    return lines
+
+
+# Updates take no lock: under the GIL an in-place add on a list item or dict
+# value is not interrupted, and they sit on every request's hot path.
+class Counters:
+    """A family of monotonically increasing counters keyed by label values."""
+
+    def __init__(self, name, help, label_names=()):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self._values = defaultdict(int)
+
+    def inc(self, labels=(), amount=1):
+        self._values[labels] += amount
+
+    def exposition(self):
+        samples = sorted(self._values.copy().items())
+        return metric_lines(self.name, 'counter', self.help, self.label_names, samples)
+
+
+class Histogram:
+    """One labelled series of a Histograms family."""
+
+    __slots__ = ('bounds', 'counts', 'total')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.total += seconds
+
+
+class Histograms:
+    """A family of latency histograms with HDR-style log-linear buckets.
+
+    Each power of two between `lowest` and `highest` seconds is split into
+    `sub_buckets` equal steps, so relative error is bounded at every scale and
+    recording a value is one bisect and two additions. Hot paths should keep
+    the series returned by labels() rather than look it up per observation.
+    """
+
+    def __init__(self, name, help, label_names=(), lowest=1e-5, highest=100.0, sub_buckets=2):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        bounds = []
+        base = lowest
+        while base < highest:
+            bounds.extend(base * (1 + i / sub_buckets) for i in range(1, sub_buckets + 1))
+            base *= 2
+        self.bounds = bounds
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        histogram = self._histograms.get(values)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(values, Histogram(self.bounds))
+        return histogram
+
+    def observe(self, labels, seconds):
+        self.labels(*labels).observe(seconds)
+
+    def exposition(self):
+        with self._lock:
+            snapshot = sorted((labels, list(h.counts), h.total) for labels, h in self._histograms.items())
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s histogram' % self.name]
+        names = self.label_names + ('le',)
+        for labels, counts, total in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.bounds, counts):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (self.name, format_labels(names, labels + ('%.6g' % bound,)),
+                                                 cumulative))
+            cumulative += counts[-1]
+            lines.append('%s_bucket%s %d' % (self.name, format_labels(names, labels + ('+Inf',)), cumulative))
+            lines.append('%s_sum%s %r' % (self.name, format_labels(self.label_names, labels), total))
+            lines.append('%s_count%s %d' % (self.name, format_labels(self.label_names, labels), cumulative))
+        return lines
@@ -0,0 +1,107 @@
+import marshal
+import sys
+import threading
+import time
+from collections import Counter
+
+# Stack-sampling profiler for a running process: every `interval` seconds it
+# reads the current frame of every thread through sys._current_frames(). No
+# tracing hooks are installed, so the profiled threads run at full speed and
+# the only cost is the sampling thread itself.
+
+
+class Busy(Exception):
+    pass
+
+
+_running = threading.Lock()
+
+
+def sample(seconds, interval=0.01):
+    """Return a Counter of (thread name, stack) samples, stacks root first.
+
+    Each stack is a tuple of code objects. Only one sampling run happens at a
+    time; a concurrent call raises Busy.
+    """
+    if not _running.acquire(blocking=False):
+        raise Busy('a profile is already running')
+    try:
+        me = threading.get_ident()
+        samples = Counter()
+        names = {}
+        # Idle threads sit on the same frame and instruction between samples,
+        # so their previous stack is reused instead of walked again
+        last = {}
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                if ident not in names:
+                    names.update((t.ident, t.name) for t in threading.enumerate())
+                previous = last.get(ident)
+                if previous is not None and previous[0] is frame and previous[1] == frame.f_lasti:
+                    key = previous[2]
+                else:
+                    top, lasti = frame, frame.f_lasti
+                    stack = []
+                    while frame is not None:
+                        stack.append(frame.f_code)
+                        frame = frame.f_back
+                    stack.reverse()
+                    key = names.get(ident, str(ident)), tuple(stack)
+                    last[ident] = top, lasti, key
+                samples[key] += 1
+            frame = top = previous = None
+            time.sleep(interval)
+        return samples
+    finally:
+        _running.release()
+
+
+def label(code):
+    return '%s (%s:%d)' % (code.co_name, code.co_filename, code.co_firstlineno)
+
+
+def collapsed(samples):
+    """Brendan Gregg's collapsed-stack text, one `thread;frame;...;leaf count` per line."""
+    lines = []
+    for (thread, stack), count in sorted(samples.items(), key=lambda item: -item[1]):
+        lines.append('%s %d' % (';'.join([thread.replace(';', '_')] + [label(c) for c in stack]), count))
+    return '\n'.join(lines) + '\n'
+
+
+def pstats_dump(samples, interval):
+    """Marshalled stats in the format pstats.Stats loads, built from samples.
+
+    Sample counts stand in for call counts and each sample is charged
+    `interval` seconds, to its leaf function as own time and to every function
+    on the stack as cumulative time.
+    """
+    stats = {}
+
+    def entry(code):
+        key = (code.co_filename, code.co_firstlineno, code.co_name)
+        if key not in stats:
+            stats[key] = [0, 0, 0.0, 0.0, {}]
+        return key, stats[key]
+
+    for (_, stack), count in samples.items():
+        seconds = count * interval
+        seen = set()
+        caller = None
+        for depth, code in enumerate(stack):
+            key, stat = entry(code)
+            leaf = depth == len(stack) - 1
+            if key not in seen:
+                seen.add(key)
+                stat[0] += count
+                stat[1] += count
+                stat[3] += seconds
+            if leaf:
+                stat[2] += seconds
+            if caller is not None:
+                cc, nc, tt, ct = stat[4].get(caller, (0, 0, 0.0, 0.0))
+                stat[4][caller] = (cc + count, nc + count, tt + (seconds if leaf else 0.0), ct + seconds)
+            caller = key
+    return marshal.dumps({key: tuple(stat) for key, stat in stats.items()})
@@ -0,0 +1,724 @@
+import asyncio
+import functools
+import ipaddress
+import os
+import queue
+import re
+import secrets
+import select
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import idna
+
+QTYPES = {'A': 1, 'NS': 2, 'CNAME': 5, 'SOA': 6, 'PTR': 12, 'MX': 15, 'TXT': 16,
+          'AAAA': 28, 'SRV': 33, 'CAA': 257}
+QTYPE_NAMES = {v: k for k, v in QTYPES.items()}
+CLASS_IN = 1
+# EDNS0 (RFC 6891) payload size advertised on UDP queries; the 1232 bytes
+# recommended by DNS Flag Day 2020 avoid IP fragmentation on common paths
+EDNS_PAYLOAD = 1232
+HOSTNAME = re.compile(r'(?!-)[a-z0-9_-]{1,63}(?<!-)(?:\.(?!-)[a-z0-9_-]{1,63}(?<!-))*')
+
+
+class ResolverError(Exception):
+    pass
+
+
+class NXDomain(ResolverError):
+    """The name does not exist: an authoritative answer, not a failure."""
+
+
+class Mismatch(ResolverError):
+    """The response is not for the query that was sent."""
+
+
+class Truncated(ResolverError):
+    """The response had the TC bit set and must be retried over TCP."""
+
+
+class Record:
+    """One resource record, kept compact for large caches.
+
+    Addresses are stored packed (A as a 32-bit int, AAAA as 16 bytes) and only
+    formatted when `data` is read; owner names are interned so repeated names
+    share one string.
+    """
+
+    __slots__ = ('name', 'qtype', 'ttl', 'rdata')
+
+    def __init__(self, name, qtype, ttl, rdata):
+        self.name = sys.intern(name)
+        self.qtype = qtype
+        self.ttl = ttl
+        self.rdata = rdata
+
+    @classmethod
+    def from_text(cls, name, rtype, ttl, data):
+        qtype = QTYPES[rtype]
+        if qtype == 1:
+            data = int(ipaddress.IPv4Address(data))
+        elif qtype == 28:
+            data = ipaddress.IPv6Address(data).packed
+        return cls(name, qtype, ttl, data)
+
+    @property
+    def type(self):
+        return QTYPE_NAMES.get(self.qtype, str(self.qtype))
+
+    @property
+    def data(self):
+        if self.qtype == 1:
+            return socket.inet_ntop(socket.AF_INET, self.rdata.to_bytes(4, 'big'))
+        if self.qtype == 28:
+            return socket.inet_ntop(socket.AF_INET6, self.rdata)
+        return self.rdata
+
+    def as_dict(self, elapsed=0):
+        return {'name': self.name, 'type': self.type, 'ttl': max(0, self.ttl - elapsed), 'data': self.data}
+
+
+def default_nameserver():
+    try:
+        with open('/etc/resolv.conf') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0] == 'nameserver':
+                    return parts[1]
+    except OSError:
+        pass
+    return '127.0.0.1'
+
+
+@functools.lru_cache(maxsize=8192)
+def normalize_name(name):
+    """Return `name` in the canonical form used for queries and cache keys.
+
+    IP addresses come back compressed; host names are mapped and encoded
+    with UTS-46 (IDNA 2008, so faß.de stays distinct from fass.de),
+    lower-cased and stripped of a trailing dot. Raises ValueError for
+    anything that is not a valid name.
+    """
+    name = name.strip()
+    if not name:
+        raise ValueError('missing domain name')
+    try:
+        return str(ipaddress.ip_address(name))
+    except ValueError:
+        pass
+    if name.endswith('.'):
+        name = name[:-1]
+    if not name.isascii():
+        try:
+            name = idna.encode(name, uts46=True).decode('ascii')
+        except UnicodeError:
+            raise ValueError('invalid domain name %r' % name) from None
+    name = name.lower()
+    if len(name) > 253 or not HOSTNAME.fullmatch(name):
+        raise ValueError('invalid domain name %r' % name)
+    return sys.intern(name)
+
+
+def encode_name(name):
+    out = bytearray()
+    for label in name.rstrip('.').split('.'):
+        try:
+            raw = label.encode('ascii')
+        except UnicodeEncodeError:
+            raw = b''
+        if not 0 < len(raw) < 64:
+            raise ResolverError('invalid label in %r' % name)
+        out.append(len(raw))
+        out += raw
+    out.append(0)
+    return bytes(out)
+
+
+def build_query(name, qtype, qid, edns=True):
+    header = struct.pack('!HHHHHH', qid, 0x0100, 1, 0, 0, 1 if edns else 0)
+    query = header + encode_name(name) + struct.pack('!HH', qtype, CLASS_IN)
+    if edns:
+        # OPT pseudo-record: root owner, type 41, CLASS carries the payload size
+        query += b'\x00' + struct.pack('!HHIH', 41, EDNS_PAYLOAD, 0, 0)
+    return query
+
+
+def read_name(view, offset, names=None):
+    """Decode the (possibly compressed) name at offset into (name, end).
+
+    `names` memoises decoded names by offset for the packet being parsed, so
+    compression pointers to an owner name that was already read cost a lookup.
+    """
+    labels = []
+    start = offset
+    end = None
+    for _ in range(128):
+        length = view[offset]
+        if length >= 0xC0:
+            if end is None:
+                end = offset + 2
+            offset = ((length & 0x3F) << 8) | view[offset + 1]
+            if names is not None and offset in names:
+                if names[offset]:
+                    labels.append(names[offset])
+                break
+        elif length == 0:
+            if end is None:
+                end = offset + 1
+            break
+        else:
+            labels.append(str(view[offset + 1:offset + 1 + length], 'ascii', 'replace'))
+            offset += 1 + length
+    else:
+        raise ResolverError('compression loop')
+    name = '.'.join(labels)
+    if names is not None:
+        names[start] = name
+    return name or '.', end
+
+
+def skip_name(view, offset):
+    """Return the offset just past the name at offset without decoding it."""
+    while True:
+        length = view[offset]
+        if length >= 0xC0:
+            return offset + 2
+        if length == 0:
+            return offset + 1
+        offset += 1 + length
+
+
+def character_strings(view):
+    strings = []
+    offset = 0
+    while offset < len(view):
+        length = view[offset]
+        strings.append(str(view[offset + 1:offset + 1 + length], 'utf-8', 'replace'))
+        offset += 1 + length
+    return strings
+
+
+def quote(text):
+    return '"%s"' % text.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def decode_rdata(view, rtype, offset, rdlength, names=None):
+    """Decode one record's RDATA into the form a Record stores.
+
+    Addresses stay packed; everything else is rendered in zone-file
+    presentation format.
+    """
+    rdata = view[offset:offset + rdlength]
+    if rtype == 1:
+        return int.from_bytes(rdata, 'big')
+    if rtype == 28:
+        return bytes(rdata)
+    if rtype in (2, 5, 12):
+        return read_name(view, offset, names)[0]
+    if rtype == 15:
+        preference, = struct.unpack_from('!H', rdata)
+        return '%d %s' % (preference, read_name(view, offset + 2, names)[0])
+    if rtype == 16:
+        return ' '.join(quote(s) for s in character_strings(rdata))
+    if rtype == 6:
+        mname, end = read_name(view, offset, names)
+        rname, end = read_name(view, end, names)
+        return '%s %s %d %d %d %d %d' % ((mname, rname) + struct.unpack_from('!IIIII', view, end))
+    if rtype == 33:
+        priority, weight, port = struct.unpack_from('!HHH', rdata)
+        return '%d %d %d %s' % (priority, weight, port, read_name(view, offset + 6, names)[0])
+    if rtype == 257:
+        flags, tag_length = rdata[0], rdata[1]
+        tag = str(rdata[2:2 + tag_length], 'ascii', 'replace')
+        return '%d %s %s' % (flags, tag, quote(str(rdata[2 + tag_length:], 'utf-8', 'replace')))
+    return rdata.hex()
+
+
+def reverse_name(address):
+    """Return the in-addr.arpa/ip6.arpa name for an IP address, else None."""
+    try:
+        return ipaddress.ip_address(address).reverse_pointer
+    except ValueError:
+        return None
+
+
+def parse_response(packet, qid, wanted=None, question=None):
+    """Parse a response into (rcode, records, negative_ttl).
+
+    The packet is walked in place through a memoryview. Only answer records
+    whose type is in `wanted` (all when None) have their owner name and RDATA
+    decoded; the question and authority sections are skipped by offset.
+    When `question` is a (name, qtype) pair the response must echo it.
+    """
+    view = memoryview(packet)
+    names = {}
+    try:
+        rid, flags, qdcount, ancount, nscount = struct.unpack_from('!HHHHH', view)
+        if rid != qid:
+            raise Mismatch('mismatched response id')
+        if question is not None:
+            qname, end = read_name(view, 12, names) if qdcount == 1 else ('', 12)
+            if (qname.lower() != question[0].rstrip('.').lower() or
+                    struct.unpack_from('!HH', view, end) != (question[1], CLASS_IN)):
+                raise Mismatch('response is for a different question')
+        if flags & 0x0200:
+            raise Truncated('truncated response')
+        offset = 12
+        for _ in range(qdcount):
+            offset = skip_name(view, offset) + 4
+        records = []
+        for _ in range(ancount):
+            owner = offset
+            offset = skip_name(view, offset)
+            rtype, _, ttl, rdlength = struct.unpack_from('!HHIH', view, offset)
+            offset += 10
+            if offset + rdlength > len(view):
+                raise ResolverError('malformed response: record runs past the end')
+            if wanted is None or rtype in wanted:
+                records.append(Record(read_name(view, owner, names)[0], rtype, ttl,
+                                      decode_rdata(view, rtype, offset, rdlength, names)))
+            offset += rdlength
+        # RFC 2308: negative answers live for min(SOA TTL, SOA MINIMUM)
+        negative_ttl = None
+        for _ in range(nscount):
+            offset = skip_name(view, offset)
+            rtype, _, ttl, rdlength = struct.unpack_from('!HHIH', view, offset)
+            offset += 10 + rdlength
+            if rtype == 6:
+                minimum, = struct.unpack_from('!I', view, offset - 4)
+                negative_ttl = min(ttl, minimum)
+    except (struct.error, IndexError, ValueError) as e:
+        raise ResolverError('malformed response: %s' % e)
+    return flags & 0x000F, records, negative_ttl
+
+
+def recv_exactly(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ResolverError('connection closed mid-response')
+        data += chunk
+    return data
+
+
+def query_tcp(name, qtype, server=None, port=53, timeout=2.0):
+    """One query over TCP (RFC 7766), used when a UDP answer was truncated."""
+    server = server or default_nameserver()
+    qid = secrets.randbits(16)
+    packet = build_query(name, qtype, qid, edns=False)
+    try:
+        with socket.create_connection((server, port), timeout) as sock:
+            sock.sendall(struct.pack('!H', len(packet)) + packet)
+            size, = struct.unpack('!H', recv_exactly(sock, 2))
+            return parse_response(recv_exactly(sock, size), qid, (qtype, 5), (name, qtype))
+    except OSError as e:
+        raise ResolverError('TCP query to %s for %s failed: %s' % (server, name, e))
+
+
+def query(name, qtype, server=None, port=53, timeout=2.0, retries=1):
+    server = server or default_nameserver()
+    family = socket.AF_INET6 if ':' in server else socket.AF_INET
+    buf = bytearray(4096)
+    with socket.socket(family, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(timeout)
+        # A connected socket only receives datagrams from the server itself, and
+        # the unpredictable id and echoed question must match as well
+        try:
+            sock.connect((server, port))
+        except OSError as e:
+            raise ResolverError('cannot query %s for %s: %s' % (server, name, e))
+        for _ in range(retries + 1):
+            qid = secrets.randbits(16)
+            try:
+                sock.send(build_query(name, qtype, qid))
+                while True:
+                    size = sock.recv_into(buf)
+                    if size >= 2 and buf[0] << 8 | buf[1] == qid:
+                        try:
+                            return parse_response(memoryview(buf)[:size], qid, (qtype, 5), (name, qtype))
+                        except Mismatch:
+                            continue
+            except socket.timeout:
+                continue
+            except Truncated:
+                return query_tcp(name, qtype, server, port, timeout)
+            except OSError as e:
+                raise ResolverError('cannot query %s for %s: %s' % (server, name, e))
+    raise ResolverError('timed out querying %s for %s' % (server, name))
+
+
+class _QueryProtocol(asyncio.DatagramProtocol):
+    def __init__(self, qid, name, qtype, future):
+        self.qid = qid
+        self.name = name
+        self.qtype = qtype
+        self.future = future
+
+    def datagram_received(self, packet, addr):
+        if not self.future.done() and packet[:2] == struct.pack('!H', self.qid):
+            try:
+                self.future.set_result(parse_response(packet, self.qid, (self.qtype, 5),
+                                                      (self.name, self.qtype)))
+            except Mismatch:
+                pass
+            except ResolverError as e:
+                self.future.set_exception(e)
+
+    def error_received(self, exc):
+        if not self.future.done():
+            self.future.set_exception(ResolverError(str(exc)))
+
+
+async def query_async(name, qtype, server=None, port=53, timeout=2.0, retries=1):
+    server = server or default_nameserver()
+    loop = asyncio.get_running_loop()
+    for _ in range(retries + 1):
+        qid = secrets.randbits(16)
+        future = loop.create_future()
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: _QueryProtocol(qid, name, qtype, future), remote_addr=(server, port))
+        try:
+            transport.sendto(build_query(name, qtype, qid))
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            continue
+        except Truncated:
+            return await query_tcp_async(name, qtype, server, port, timeout)
+        finally:
+            transport.close()
+    raise ResolverError('timed out querying %s for %s' % (server, name))
+
+
+async def query_tcp_async(name, qtype, server=None, port=53, timeout=2.0):
+    server = server or default_nameserver()
+    qid = secrets.randbits(16)
+    packet = build_query(name, qtype, qid, edns=False)
+
+    async def exchange():
+        reader, writer = await asyncio.open_connection(server, port)
+        try:
+            writer.write(struct.pack('!H', len(packet)) + packet)
+            size, = struct.unpack('!H', await reader.readexactly(2))
+            return await reader.readexactly(size)
+        finally:
+            writer.close()
+
+    try:
+        response = await asyncio.wait_for(exchange(), timeout)
+    except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+        raise ResolverError('TCP query to %s for %s failed: %r' % (server, name, e))
+    return parse_response(response, qid, (qtype, 5), (name, qtype))
+
+
+NSLOOKUP_ANSWER = re.compile(
+    r'^Name:\s*(?P<name>\S+)\s*\nAddress:\s*(?P<address>\S+)'
+    r'|^(?P<owner>\S+)\s+(?P<label>canonical name|mail exchanger|text|nameserver|name|service|rdata_257)'
+    r'\s*=\s*(?P<value>.+?)\.?$'
+    r'|^(?P<zone>\S+)\n\s+origin = (?P<soa>\S+?)\.?\n\s+mail addr = (?P<mbox>\S+?)\.?\n'
+    r'\s+serial = (?P<serial>\d+)\n\s+refresh = (?P<refresh>\d+)\n\s+retry = (?P<retry>\d+)\n'
+    r'\s+expire = (?P<expire>\d+)\n\s+minimum = (?P<minimum>\d+)',
+    re.MULTILINE)
+NSLOOKUP_LABELS = {'canonical name': 'CNAME', 'mail exchanger': 'MX', 'text': 'TXT',
+                   'nameserver': 'NS', 'name': 'PTR', 'service': 'SRV', 'rdata_257': 'CAA'}
+NSLOOKUP_FAILURE = re.compile(r"^\*\* server can't find .*: (?P<rcode>[A-Z]+)\s*$", re.MULTILINE)
+NSLOOKUP_RCODES = {'NOERROR': 0, 'FORMERR': 1, 'SERVFAIL': 2, 'NXDOMAIN': 3, 'NOTIMP': 4, 'REFUSED': 5}
+# Transport failures; other ';;' lines (retrying over TCP, recursion not
+# available) are only warnings
+NSLOOKUP_ERROR = re.compile(
+    r'^;; (?P<error>(?:connection timed out|communications error|no servers could be reached).*)$',
+    re.MULTILINE)
+
+
+def parse_nslookup(output, default_ttl):
+    """Turn nslookup's text output into (rcode, records) for one query.
+
+    Raises ResolverError when no server could be reached.
+    """
+    m = NSLOOKUP_FAILURE.search(output)
+    if m:
+        if m.group('rcode') not in NSLOOKUP_RCODES:
+            raise ResolverError('nslookup failed: %s' % m.group(0))
+        return NSLOOKUP_RCODES[m.group('rcode')], []
+    # The leading Server/Address block describes the resolver, not the answer,
+    # and anything after the authority banner is not part of the answer either
+    answer = output.split('\n\n', 1)[-1].split('Authoritative answers can be found from', 1)[0]
+    records = []
+    for m in NSLOOKUP_ANSWER.finditer(answer):
+        if m.group('name'):
+            address = m.group('address')
+            records.append(Record.from_text(m.group('name'), 'AAAA' if ':' in address else 'A',
+                                            default_ttl, address))
+        elif m.group('owner'):
+            records.append(Record.from_text(m.group('owner'), NSLOOKUP_LABELS[m.group('label')],
+                                            default_ttl, m.group('value')))
+        else:
+            records.append(Record.from_text(m.group('zone'), 'SOA', default_ttl, ' '.join(m.group(
+                'soa', 'mbox', 'serial', 'refresh', 'retry', 'expire', 'minimum'))))
+    if not records:
+        m = NSLOOKUP_ERROR.search(output)
+        if m:
+            raise ResolverError('nslookup failed: %s' % m.group('error'))
+    return 0, records
+
+
+class Backend:
+    """Resolves one (name, type) question to (rcode, records, negative_ttl)."""
+
+    def __init__(self, server=None, port=53, timeout=2.0, default_ttl=60, workers=16):
+        self.server = server or default_nameserver()
+        self.port = port
+        self.timeout = timeout
+        self.default_ttl = default_ttl
+        self.workers = workers
+
+    def query(self, name, rtype):
+        raise NotImplementedError
+
+    async def query_async(self, name, rtype):
+        return await asyncio.get_running_loop().run_in_executor(None, self.query, name, rtype)
+
+    def stats(self):
+        return {}
+
+    def close(self):
+        pass
+
+
+class NativeBackend(Backend):
+    def query(self, name, rtype):
+        return query(name, QTYPES[rtype], self.server, self.port, self.timeout)
+
+    async def query_async(self, name, rtype):
+        return await query_async(name, QTYPES[rtype], self.server, self.port, self.timeout)
+
+
+class GetaddrinfoBackend(Backend):
+    """Uses the system resolver; only A/AAAA, and without real TTLs."""
+
+    FAMILIES = {'A': socket.AF_INET, 'AAAA': socket.AF_INET6}
+    NO_ANSWER = {getattr(socket, code) for code in ('EAI_NONAME', 'EAI_NODATA', 'EAI_ADDRFAMILY')
+                 if hasattr(socket, code)}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = ThreadPoolExecutor(self.workers, thread_name_prefix='getaddrinfo')
+
+    def _getaddrinfo(self, name, rtype):
+        if rtype not in self.FAMILIES:
+            raise ResolverError('getaddrinfo backend cannot resolve %s records' % rtype)
+        try:
+            infos = socket.getaddrinfo(name, None, self.FAMILIES[rtype], socket.SOCK_STREAM)
+        except socket.gaierror as e:
+            if e.errno not in self.NO_ANSWER:
+                raise ResolverError(str(e))
+            # A family-specific failure can still mean the name exists (NODATA)
+            try:
+                socket.getaddrinfo(name, None, socket.AF_UNSPEC, socket.SOCK_STREAM)
+            except socket.gaierror:
+                return 3, [], self.default_ttl
+            return 0, [], self.default_ttl
+        addresses = dict.fromkeys(info[4][0] for info in infos)
+        return 0, [Record.from_text(name, rtype, self.default_ttl, a) for a in addresses], None
+
+    def query(self, name, rtype):
+        return self.pool.submit(self._getaddrinfo, name, rtype).result()
+
+    def close(self):
+        self.pool.shutdown()
+
+    async def query_async(self, name, rtype):
+        return await asyncio.get_running_loop().run_in_executor(
+            self.pool, self._getaddrinfo, name, rtype)
+
+
+class SubprocessBackend(Backend):
+    """Legacy backend: runs nslookup with an argument vector, no shell."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.spawned = 0
+
+    @staticmethod
+    def checked(name, rtype):
+        # nslookup reads options and commands from the same words as names, so
+        # anything but a canonical host name or address never reaches it
+        try:
+            name = normalize_name(name)
+        except ValueError as e:
+            raise ResolverError(str(e)) from None
+        if rtype not in QTYPES:
+            raise ResolverError('unsupported record type %r' % rtype)
+        return name, rtype
+
+    def argv(self, name, rtype):
+        name, rtype = self.checked(name, rtype)
+        return ['nslookup', '-type=' + rtype, '-port=%d' % self.port, name, self.server]
+
+    def parse(self, stdout, returncode=0):
+        rcode, records, negative_ttl = self.parse_text(stdout.decode(errors='replace'))
+        # nslookup also exits nonzero for NXDOMAIN and SERVFAIL, which
+        # parse_text has already turned into an rcode
+        if returncode and rcode == 0 and not records:
+            raise ResolverError('nslookup exited with status %d' % returncode)
+        return rcode, records, negative_ttl
+
+    def parse_text(self, output):
+        rcode, records = parse_nslookup(output, self.default_ttl)
+        return rcode, records, self.default_ttl if not records else None
+
+    def query(self, name, rtype):
+        try:
+            self.spawned += 1
+            proc = subprocess.run(self.argv(name, rtype), stdout=subprocess.PIPE,
+                                  stderr=subprocess.STDOUT, timeout=self.timeout * 3)
+        except subprocess.TimeoutExpired:
+            raise ResolverError('nslookup timed out for %s' % name)
+        except OSError as e:
+            raise ResolverError('cannot run nslookup: %s' % e)
+        return self.parse(proc.stdout, proc.returncode)
+
+    async def query_async(self, name, rtype):
+        try:
+            self.spawned += 1
+            proc = await asyncio.create_subprocess_exec(
+                *self.argv(name, rtype), stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT)
+        except OSError as e:
+            raise ResolverError('cannot run nslookup: %s' % e)
+        try:
+            stdout, _ = await asyncio.wait_for(proc.communicate(), self.timeout * 3)
+        except asyncio.TimeoutError:
+            proc.kill()
+            raise ResolverError('nslookup timed out for %s' % name)
+        return self.parse(stdout, proc.returncode)
+
+    def stats(self):
+        return {'spawned': self.spawned}
+
+
+class _NslookupWorker:
+    """One interactive nslookup process that answers queries over its pipes."""
+
+    def __init__(self, server, port):
+        self.proc = subprocess.Popen(['nslookup', '-port=%d' % port, '-', server],
+                                     stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                     stderr=subprocess.STDOUT)
+        self.serial = 0
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def ask(self, name, rtype, timeout):
+        # nslookup prints nothing after an answer, so each query is followed by
+        # an invalid "set" option whose error message marks the end of output
+        self.serial += 1
+        marker = b'Invalid option: end%d' % self.serial
+        self.proc.stdin.write(b'set type=%s\n%s.\nset end%d\n'
+                              % (rtype.encode(), name.rstrip('.').encode(), self.serial))
+        self.proc.stdin.flush()
+        fd = self.proc.stdout.fileno()
+        output = b''
+        deadline = time.monotonic() + timeout
+        while marker not in output:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+                raise ResolverError('nslookup worker timed out for %s' % name)
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                raise ResolverError('nslookup worker exited')
+            output += chunk
+        output = output[:output.index(marker)].decode(errors='replace')
+        return output.replace('\n> ', '\n').lstrip('> ')
+
+    def close(self):
+        self.proc.kill()
+        self.proc.wait()
+
+
+class PooledSubprocessBackend(SubprocessBackend):
+    """Legacy backend on a pool of long-lived interactive nslookup processes.
+
+    Processes are started on first use, replaced when they exit or stop
+    answering, and at most `workers * queue_per_worker` callers may wait for
+    a free one; any more are turned away at once.
+    """
+
+    def __init__(self, *args, queue_per_worker=4, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.queue_per_worker = queue_per_worker
+        self.restarts = 0
+        self._idle = queue.LifoQueue()
+        for _ in range(self.workers):
+            self._idle.put(None)
+        # One slot per worker plus the callers allowed to wait for one
+        self._admitted = threading.BoundedSemaphore(self.workers * (1 + queue_per_worker))
+
+    def query(self, name, rtype):
+        name, rtype = self.checked(name, rtype)
+        if not self._admitted.acquire(blocking=False):
+            raise ResolverError('nslookup pool queue is full')
+        try:
+            try:
+                worker = self._idle.get(timeout=self.timeout * 3)
+            except queue.Empty:
+                raise ResolverError('no nslookup worker became free')
+            try:
+                if worker is None or not worker.alive():
+                    if worker is not None:
+                        self.restarts += 1
+                    self.spawned += 1
+                    worker = _NslookupWorker(self.server, self.port)
+                output = worker.ask(name, rtype, self.timeout * 3)
+            except OSError as e:
+                if worker is not None:
+                    worker.close()
+                    worker = None
+                raise ResolverError('cannot run nslookup: %s' % e)
+            except ResolverError:
+                if worker is not None:
+                    worker.close()
+                    worker = None
+                self.restarts += 1
+                raise
+            finally:
+                self._idle.put(worker)
+        finally:
+            self._admitted.release()
+        # Parsed once the worker is back in the pool: an unreachable server is
+        # not the worker's fault and must not get it restarted
+        return self.parse_text(output)
+
+    async def query_async(self, name, rtype):
+        return await asyncio.get_running_loop().run_in_executor(None, self.query, name, rtype)
+
+    def stats(self):
+        return dict(super().stats(), workers=self.workers, restarts=self.restarts)
+
+    def close(self):
+        for _ in range(self.workers):
+            worker = self._idle.get()
+            if worker is not None:
+                worker.close()
+
+
+BACKENDS = {
+    'native': NativeBackend,
+    'getaddrinfo': GetaddrinfoBackend,
+    'subprocess': SubprocessBackend,
+    'popen': SubprocessBackend,
+    'nslookup-pool': PooledSubprocessBackend,
+}
+
+
+def make_backend(kind, **options):
+    if kind not in BACKENDS:
+        raise ValueError('unknown DNS backend %r (choose from %s)'
+                         % (kind, ', '.join(sorted(BACKENDS))))
+    return BACKENDS[kind](**options)
+
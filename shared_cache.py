@@ -0,0 +1,135 @@
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+
+from resolver import Record
+from snapshot import RECORD, decode_rdata, encode_key, encode_rdata, key_hash
+
+# A fixed-size, 4-way set-associative hash table in a memory-mapped file that
+# every worker process on the host maps. Writers serialise per stripe of sets
+# with a thread lock plus an fcntl byte-range lock; readers take no lock and
+# use the per-slot sequence number (odd while a write is in progress) to
+# detect and discard torn reads.
+MAGIC = b'DNSSHM01'
+HEADER = struct.Struct('!8sII')
+SLOT_HEADER = struct.Struct('!IQdH')
+WAYS = 4
+
+
+class SharedAnswerCache:
+    def __init__(self, path, slots=65536, slot_size=512, stripes=64):
+        self.path = path
+        self.sets = max(1, slots // WAYS)
+        self.slot_size = slot_size
+        self.stripes = stripes
+        self.hits = 0
+        self.misses = 0
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        size = HEADER.size + self.sets * WAYS * slot_size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size == 0:
+                os.ftruncate(self._fd, size)
+                os.pwrite(self._fd, HEADER.pack(MAGIC, self.sets, slot_size), 0)
+            magic, sets, stored_slot_size = HEADER.unpack(os.pread(self._fd, HEADER.size, 0))
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+        if magic != MAGIC or (sets, stored_slot_size) != (self.sets, slot_size):
+            os.close(self._fd)
+            raise ValueError('%s holds a shared cache with a different layout' % path)
+        self._map = mmap.mmap(self._fd, size)
+
+    def _slot_offset(self, set_index, way):
+        return HEADER.size + (set_index * WAYS + way) * self.slot_size
+
+    def _read_slot(self, offset):
+        for _ in range(3):
+            seq, = struct.unpack_from('!I', self._map, offset)
+            if seq & 1:
+                continue
+            raw = self._map[offset:offset + self.slot_size]
+            if struct.unpack_from('!I', self._map, offset)[0] == seq:
+                return raw
+        return None
+
+    def get(self, key):
+        """Return (records, seconds left) for an unexpired entry, else None."""
+        key_bytes = encode_key(key)
+        h = key_hash(key_bytes)
+        set_index = h % self.sets
+        for way in range(WAYS):
+            raw = self._read_slot(self._slot_offset(set_index, way))
+            if raw is None:
+                continue
+            _, slot_hash, expires, length = SLOT_HEADER.unpack_from(raw)
+            if slot_hash != h or length == 0:
+                continue
+            remaining = expires - time.time()
+            payload = memoryview(raw)[SLOT_HEADER.size:SLOT_HEADER.size + length]
+            key_len, = struct.unpack_from('!H', payload)
+            if remaining <= 0 or payload[2:2 + key_len] != key_bytes:
+                continue
+            self.hits += 1
+            return self._decode_records(payload, 2 + key_len), remaining
+        self.misses += 1
+        return None
+
+    def _decode_records(self, payload, offset):
+        count, = struct.unpack_from('!H', payload, offset)
+        offset += 2
+        records = []
+        for _ in range(count):
+            name_len, qtype, ttl, rdata_len = RECORD.unpack_from(payload, offset)
+            offset += RECORD.size
+            name = str(payload[offset:offset + name_len], 'utf-8')
+            offset += name_len
+            records.append(Record(name, qtype, ttl, decode_rdata(qtype, payload[offset:offset + rdata_len])))
+            offset += rdata_len
+        return tuple(records)
+
+    def put(self, key, records, ttl):
+        key_bytes = encode_key(key)
+        payload = bytearray(struct.pack('!H', len(key_bytes)) + key_bytes + struct.pack('!H', len(records)))
+        for record in records:
+            name = record.name.encode()
+            rdata = encode_rdata(record)
+            payload += RECORD.pack(len(name), record.qtype, record.ttl, len(rdata)) + name + rdata
+        if SLOT_HEADER.size + len(payload) > self.slot_size:
+            return False
+        h = key_hash(key_bytes)
+        set_index = h % self.sets
+        stripe = set_index % self.stripes
+        with self._locks[stripe]:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, stripe)
+            try:
+                offset = self._victim(set_index, h)
+                seq, = struct.unpack_from('!I', self._map, offset)
+                struct.pack_into('!I', self._map, offset, seq + 1)
+                struct.pack_into('!QdH', self._map, offset + 4, h, time.time() + ttl, len(payload))
+                self._map[offset + SLOT_HEADER.size:offset + SLOT_HEADER.size + len(payload)] = payload
+                struct.pack_into('!I', self._map, offset, seq + 2)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, stripe)
+        return True
+
+    def _victim(self, set_index, h):
+        # Same key first, then an empty or expired way, then the one expiring soonest
+        now = time.time()
+        best = None
+        for way in range(WAYS):
+            offset = self._slot_offset(set_index, way)
+            _, slot_hash, expires, length = SLOT_HEADER.unpack_from(self._map, offset)
+            if slot_hash == h:
+                return offset
+            if length == 0 or expires <= now:
+                expires = float('-inf')
+            if best is None or expires < best[0]:
+                best = (expires, offset)
+        return best[1]
+
+    def stats(self):
+        return {'slots': self.sets * WAYS, 'hits': self.hits, 'misses': self.misses}
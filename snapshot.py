@@ -0,0 +1,136 @@
+import hashlib
+import mmap
+import os
+import struct
+import time
+
+from resolver import Record
+
+# File layout: header, then `count` index slots sorted by key hash, then one
+# blob per entry. Lookups binary-search the index through an mmap, so opening
+# a snapshot costs the same no matter how many entries it holds.
+MAGIC = b'DNSSNAP1'
+HEADER = struct.Struct('!8sI')
+SLOT = struct.Struct('!QQ')
+ENTRY = struct.Struct('!HdH')
+RECORD = struct.Struct('!HHIH')
+
+
+def key_hash(key_bytes):
+    return int.from_bytes(hashlib.blake2b(key_bytes, digest_size=8).digest(), 'big')
+
+
+def encode_key(key):
+    return ('%s\0%s' % key).encode()
+
+
+def encode_rdata(record):
+    if record.qtype == 1:
+        return record.rdata.to_bytes(4, 'big')
+    if record.qtype == 28:
+        return record.rdata
+    return record.rdata.encode()
+
+
+def decode_rdata(qtype, raw):
+    if qtype == 1:
+        return int.from_bytes(raw, 'big')
+    if qtype == 28:
+        return bytes(raw)
+    return str(raw, 'utf-8')
+
+
+def write_snapshot(path, entries):
+    """Write (key, records, expires) entries, `expires` being a wall-clock time."""
+    slots = []
+    blobs = bytearray()
+    for key, records, expires in entries:
+        key_bytes = encode_key(key)
+        blob = bytearray(ENTRY.pack(len(key_bytes), expires, len(records)) + key_bytes)
+        for record in records:
+            name = record.name.encode()
+            rdata = encode_rdata(record)
+            blob += RECORD.pack(len(name), record.qtype, record.ttl, len(rdata)) + name + rdata
+        slots.append((key_hash(key_bytes), len(blobs)))
+        blobs += blob
+    slots.sort()
+    base = HEADER.size + SLOT.size * len(slots)
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(slots)))
+        for h, offset in slots:
+            f.write(SLOT.pack(h, base + offset))
+        f.write(blobs)
+    # Readers keep their mapping of the old file; new readers see the new one
+    os.replace(tmp, path)
+
+
+class SnapshotReader:
+    """Read-only view of a snapshot file; expired entries are skipped on read."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            self._map.close()
+            raise ValueError('%s is not a DNS cache snapshot' % path)
+        self.hits = 0
+
+    def _slot(self, i):
+        return SLOT.unpack_from(self._map, HEADER.size + SLOT.size * i)
+
+    def _entry(self, offset):
+        key_len, expires, count = ENTRY.unpack_from(self._map, offset)
+        offset += ENTRY.size
+        key_bytes = self._map[offset:offset + key_len]
+        return key_bytes, expires, count, offset + key_len
+
+    def _records(self, offset, count):
+        records = []
+        for _ in range(count):
+            name_len, qtype, ttl, rdata_len = RECORD.unpack_from(self._map, offset)
+            offset += RECORD.size
+            name = str(self._map[offset:offset + name_len], 'utf-8')
+            offset += name_len
+            rdata = decode_rdata(qtype, self._map[offset:offset + rdata_len])
+            offset += rdata_len
+            records.append(Record(name, qtype, ttl, rdata))
+        return tuple(records)
+
+    def get(self, key):
+        """Return (records, seconds left) for an unexpired entry, else None."""
+        key_bytes = encode_key(key)
+        h = key_hash(key_bytes)
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._slot(mid)[0] < h:
+                lo = mid + 1
+            else:
+                hi = mid
+        while lo < self.count:
+            slot_hash, offset = self._slot(lo)
+            if slot_hash != h:
+                break
+            stored_key, expires, count, offset = self._entry(offset)
+            if stored_key == key_bytes:
+                remaining = expires - time.time()
+                if remaining <= 0:
+                    return None
+                self.hits += 1
+                return self._records(offset, count), remaining
+            lo += 1
+        return None
+
+    def entries(self):
+        """Yield every unexpired (key, records, expires) entry."""
+        now = time.time()
+        for i in range(self.count):
+            key_bytes, expires, count, offset = self._entry(self._slot(i)[1])
+            if expires > now:
+                name, rtype = str(key_bytes, 'utf-8').split('\0')
+                yield (name, rtype), self._records(offset, count), expires
+
+    def close(self):
+        self._map.close()
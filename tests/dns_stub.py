@@ -0,0 +1,60 @@
+import socket
+import struct
+import threading
+import time
+
+import resolver
+
+# SOA rdata for negative answers: ns.test. hostmaster.test. 1 7200 3600 1209600 60
+SOA = b'\x02ns\x04test\x00\x0ahostmaster\x04test\x00' + struct.pack('!IIIII', 1, 7200, 3600, 1209600, 60)
+
+
+def txt(*strings):
+    return b''.join(bytes([len(s)]) + s.encode() for s in strings)
+
+
+class StubServer:
+    """A UDP DNS server on 127.0.0.1 answering from `zone`.
+
+    `zone` maps (name, type) to (ttl, [rdata bytes]). A name with no entry of
+    any type gets NXDOMAIN and a known name without the type gets NODATA,
+    both with a 60 second SOA. While `down` is set queries are counted but
+    never answered; `delay` holds each answer back that many seconds.
+    """
+
+    def __init__(self, zone=None):
+        self.zone = dict(zone or {})
+        self.queries = []
+        self.down = False
+        self.delay = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.port = self.sock.getsockname()[1]
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def close(self):
+        self.sock.close()
+
+    def serve(self):
+        try:
+            while True:
+                packet, peer = self.sock.recvfrom(4096)
+                name, offset = resolver.read_name(memoryview(packet), 12)
+                qtype, = struct.unpack_from('!H', packet, offset)
+                self.queries.append((name.lower(), resolver.QTYPE_NAMES.get(qtype, qtype)))
+                time.sleep(self.delay)
+                if not self.down:
+                    self.sock.sendto(self.answer(packet, name.lower(), qtype, offset + 4), peer)
+        except OSError:
+            pass
+
+    def answer(self, packet, name, qtype, end):
+        ttl, rdatas = self.zone.get((name, resolver.QTYPE_NAMES.get(qtype)), (0, []))
+        rcode = 0 if rdatas or any(key[0] == name for key in self.zone) else 3
+        records = b''.join(b'\xc0\x0c' + struct.pack('!HHIH', qtype, 1, ttl, len(rdata)) + rdata
+                           for rdata in rdatas)
+        authority = b''
+        if not rdatas:
+            authority = b'\xc0\x0c' + struct.pack('!HHIH', 6, 1, 60, len(SOA)) + SOA
+        header = packet[:2] + struct.pack('!HHHHH', 0x8180 | rcode, 1, len(rdatas), 0 if rdatas else 1, 0)
+        return header + packet[12:end] + records + authority
@@ -0,0 +1,79 @@
+# DNS responses for example.com queries, all with id 0x1234 unless noted.
+# Owner names and RDATA names use compression pointers the way real
+# resolvers emit them; the malformed ones were cut or edited by hand.
+PACKETS = {
+    'a_compressed': bytes.fromhex(
+        '123481800001000200000000076578616d706c6503636f6d0000010001c00c00'
+        '0100010000012c00045db8d822c00c000100010000007800045db8d823'
+    ),
+    'aaaa': bytes.fromhex(
+        '123481800001000100000000076578616d706c6503636f6d00001c0001c00c00'
+        '1c00010000003c00102606280002200001024818931a946c34'
+    ),
+    'cname_chain': bytes.fromhex(
+        '12348180000100020000000003777777076578616d706c6503636f6d00000100'
+        '01c00c0005000100000e100002c010c010000100010000012c00045db8d822'
+    ),
+    'ns': bytes.fromhex(
+        '123481800001000200000000076578616d706c6503636f6d0000020001c00c00'
+        '02000100015180001401610c69616e612d73657276657273036e657400c00c00'
+        '0200010001518000040162c02b'
+    ),
+    'ptr': bytes.fromhex(
+        '123481800001000100000000023334033231360331383402393307696e2d6164'
+        '6472046172706100000c0001c00c000c000100000e10000d076578616d706c65'
+        '03636f6d00'
+    ),
+    'mx': bytes.fromhex(
+        '123481800001000100000000076578616d706c6503636f6d00000f0001c00c00'
+        '0f00010000012c0009000a046d61696cc00c'
+    ),
+    'txt': bytes.fromhex(
+        '123481800001000100000000076578616d706c6503636f6d0000100001c00c00'
+        '1000010000012c00160b763d73706631202d616c6c09736179202268692221'
+    ),
+    'soa': bytes.fromhex(
+        '123481800001000100000000076578616d706c6503636f6d0000060001c00c00'
+        '06000100000e100026026e73c00c0a686f73746d6173746572c00c78a3f17500'
+        '001c2000000e10001275000000012c'
+    ),
+    'srv': bytes.fromhex(
+        '123481800001000100000000045f736970045f746370076578616d706c650363'
+        '6f6d0000210001c00c002100010000012c000c000a003c13c403736970c016'
+    ),
+    'caa': bytes.fromhex(
+        '123481800001000100000000076578616d706c6503636f6d0001010001c00c01'
+        '0100010000012c0016000569737375656c657473656e63727970742e6f7267'
+    ),
+    'nxdomain': bytes.fromhex(
+        '123481830001000000010000046e6f7065076578616d706c6503636f6d000001'
+        '0001c01100060001000003840026026e73c0110a686f73746d6173746572c011'
+        '78a3f17500001c2000000e10001275000000012c'
+    ),
+    'nodata': bytes.fromhex(
+        '123481800001000000010000076578616d706c6503636f6d00001c0001c00c00'
+        '06000100000e100026026e73c00c0a686f73746d6173746572c00c78a3f17500'
+        '001c2000000e10001275000000012c'
+    ),
+    'servfail': bytes.fromhex(
+        '123481820001000000000000076578616d706c6503636f6d0000010001'
+    ),
+    'truncated_tc': bytes.fromhex(
+        '123483800001000000000000076578616d706c6503636f6d0000100001'
+    ),
+    'cut_short': bytes.fromhex(
+        '123481800001000200000000076578616d706c6503636f6d0000010001c00c00'
+        '0100010000012c00045db8d822c00c000100010000007800045d'
+    ),
+    'pointer_loop': bytes.fromhex(
+        '123481800001000100000000076578616d706c6503636f6d0000010001c01d00'
+        '0100010000012c000401020304'
+    ),
+    'pointer_out_of_range': bytes.fromhex(
+        '123481800001000100000000076578616d706c6503636f6d0000010001c1f400'
+        '0100010000012c000401020304'
+    ),
+    'wrong_id': bytes.fromhex(
+        '432181800001000000000000076578616d706c6503636f6d0000010001'
+    ),
+}
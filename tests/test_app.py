@@ -0,0 +1,434 @@
+import asyncio
+import gzip
+import json
+import os
+import pstats
+import tempfile
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import app
+import resolver
+import snapshot
+from limits import AdmissionController, RateLimiter
+from tests.dns_stub import StubServer, txt
+
+
+class AppTestCase(unittest.TestCase):
+    """Runs the Flask app against a StubServer answering from `zone`."""
+
+    zone = {}
+
+    def setUp(self):
+        self.stub = StubServer(self.zone)
+        self.addCleanup(self.stub.close)
+        for patcher in (mock.patch.object(app.backend, 'server', '127.0.0.1'),
+                        mock.patch.object(app.backend, 'port', self.stub.port),
+                        mock.patch.dict(app.app.config, DNS_RATE_LIMIT=0)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client = app.app.test_client()
+
+    def get(self, path, **headers):
+        # Closing releases the admission slot held until the body is sent
+        with self.client.get(path, headers=headers) as response:
+            response.get_data()
+        return response
+
+
+class HtmlViewTest(AppTestCase):
+    zone = {('evil.example', 'TXT'): (300, [txt('<script>alert(1)</script>')]),
+            ('www.evil.example', 'CNAME'): (300, [b'\x08<b>x</b>\x07example\x00'])}
+
+    def test_escapes_record_data(self):
+        body = self.get('/dns-lookup?domain=evil.example&type=TXT').get_data(as_text=True)
+        self.assertNotIn('<script>', body)
+        self.assertIn('&quot;&lt;script&gt;alert(1)&lt;/script&gt;&quot;', body)
+
+    def test_escapes_names_from_answers(self):
+        body = self.get('/dns-lookup?domain=www.evil.example&type=CNAME').get_data(as_text=True)
+        self.assertNotIn('<b>', body)
+        self.assertIn('&lt;b&gt;x&lt;/b&gt;.example', body)
+
+
+class AnswerCacheTest(AppTestCase):
+    zone = {('cached.example', 'A'): (1, [bytes([10, 0, 0, 4])])}
+
+    def test_answers_are_cached_for_their_ttl(self):
+        path = '/dns-lookup?domain=cached.example&type=A'
+        first, second = self.get(path, Accept='application/json'), self.get(path, Accept='application/json')
+        self.assertEqual(first.json['records'][0]['data'], '10.0.0.4')
+        self.assertEqual(second.json, first.json)
+        self.assertEqual(self.stub.queries, [('cached.example', 'A')])
+        time.sleep(1.05)
+        self.assertEqual(self.get(path, Accept='application/json').json, first.json)
+        self.assertEqual(len(self.stub.queries), 2)
+
+
+class SingleFlightTest(AppTestCase):
+    zone = {('popular.example', 'A'): (300, [bytes([10, 0, 0, 5])])}
+
+    def test_concurrent_misses_send_one_query(self):
+        self.stub.delay = 0.2
+        coalesced = app.flight.stats()['coalesced']
+        with ThreadPoolExecutor(8) as pool:
+            answers = list(pool.map(lambda _: app.lookup('popular.example', 'A'), range(8)))
+        self.assertEqual({a[0].data for a in answers}, {'10.0.0.5'})
+        self.assertEqual(self.stub.queries, [('popular.example', 'A')])
+        self.assertEqual(app.flight.stats()['coalesced'], coalesced + 7)
+
+
+class PrefetchTest(AppTestCase):
+    zone = {('prefetched.example', 'A'): (1, [bytes([10, 0, 0, 6])])}
+
+    def test_hot_entry_is_refreshed_before_it_expires(self):
+        patcher = mock.patch.object(app.answer_cache, 'prefetch_fraction', 0.5)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        path = '/dns-lookup?domain=prefetched.example&type=A'
+        self.get(path)
+        self.get(path)
+        time.sleep(0.6)
+        self.get(path)
+        deadline = time.monotonic() + 1
+        while len(self.stub.queries) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(self.stub.queries), 2)
+        # Past the first answer's expiry the prefetched one is served
+        time.sleep(0.5)
+        self.assertEqual(self.get(path, Accept='application/json').json['records'][0]['data'], '10.0.0.6')
+        self.assertEqual(len(self.stub.queries), 2)
+
+
+class AdmissionTest(AppTestCase):
+    zone = {('admitted.example', 'A'): (300, [bytes([10, 0, 0, 8])])}
+
+    def admission(self, controller):
+        patcher = mock.patch.object(app, 'admission', controller)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return controller
+
+    def test_overload_is_shed_with_503(self):
+        self.admission(AdmissionController(0))
+        response = self.get('/dns-lookup?domain=admitted.example&type=A')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], str(app.app.config['DNS_RETRY_AFTER']))
+        self.assertEqual(self.stub.queries, [])
+
+    def test_slot_is_released_after_the_response(self):
+        admission = self.admission(AdmissionController(1))
+        for path in ('/dns-lookup?domain=admitted.example&type=A',
+                     '/dns-lookup?domain=admitted.example&type=A&stream=1',
+                     '/dns-lookup?domain=bad..name'):
+            self.get(path)
+            self.assertEqual(admission.stats()['active'], 0, path)
+        self.assertEqual(admission.stats()['admitted'], 3)
+
+
+class RateLimitTest(AppTestCase):
+    zone = {('limited.example', 'A'): (300, [bytes([10, 0, 0, 9])])}
+
+    def setUp(self):
+        super().setUp()
+        keys = {'secret': 'key:abc'}
+        for patcher in (mock.patch.object(app, 'rate_limiter', RateLimiter(1, 2)),
+                        mock.patch.object(app, 'api_clients', keys),
+                        mock.patch.dict(app.app.config, DNS_RATE_LIMIT=1, DNS_PROXY_HOPS=0)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_throttled_with_429(self):
+        path = '/dns-lookup?domain=limited.example&type=A'
+        self.assertEqual([self.get(path).status_code for _ in range(2)], [200, 200])
+        response = self.get(path)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], '1')
+        # Another API key is another client; an unknown key is just the address
+        self.assertEqual(self.get(path, **{'X-API-Key': 'secret'}).status_code, 200)
+        self.assertEqual(self.get(path, **{'X-API-Key': 'made-up'}).status_code, 429)
+        self.assertEqual(set(app.rate_limiter.stats()['top_throttled']), {'127.0.0.1'})
+
+    def test_client_id(self):
+        self.assertEqual(app.client_id('secret', '10.0.0.1', ''), 'key:abc')
+        self.assertEqual(app.client_id('other', '10.0.0.1', '192.0.2.1'), '10.0.0.1')
+        with mock.patch.dict(app.app.config, DNS_PROXY_HOPS=2):
+            # Only the entry the first trusted proxy appended counts
+            self.assertEqual(app.client_id(None, '10.0.0.1', '6.6.6.6, 192.0.2.1, 10.0.0.2'), '192.0.2.1')
+            self.assertEqual(app.client_id(None, '10.0.0.1', '10.0.0.2'), '10.0.0.1')
+
+
+class ConditionalGetTest(AppTestCase):
+    zone = {('etag.example', 'A'): (1, [bytes([10, 0, 1, 1])]),
+            ('changed.etag.example', 'A'): (1, [bytes([10, 0, 1, 1])])}
+    path = '/dns-lookup?domain=etag.example&type=A'
+
+    def test_not_modified(self):
+        response = self.get(self.path, Accept='application/json')
+        etag = response.headers['ETag']
+        self.assertTrue(etag.startswith('W/"'))
+        self.assertEqual(response.headers['Cache-Control'], 'max-age=1')
+        self.assertEqual(response.headers['Vary'], 'Accept, Accept-Encoding')
+        revalidated = self.get(self.path, Accept='application/json', **{'If-None-Match': etag})
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated.get_data(), b'')
+        self.assertEqual(revalidated.headers['ETag'], etag)
+        self.assertEqual(len(self.stub.queries), 1)
+        # Each format has its own validator
+        html = self.get(self.path, Accept='text/html', **{'If-None-Match': etag})
+        self.assertEqual(html.status_code, 200)
+        self.assertNotEqual(html.headers['ETag'], etag)
+
+    def test_changed_answer_gets_a_new_etag(self):
+        path = '/dns-lookup?domain=changed.etag.example&type=A'
+        etag = self.get(path, Accept='application/json').headers['ETag']
+        self.stub.zone[('changed.etag.example', 'A')] = (300, [bytes([10, 0, 1, 2])])
+        time.sleep(1.05)
+        response = self.get(path, Accept='application/json', **{'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['records'][0]['data'], '10.0.1.2')
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_errors_are_not_cacheable(self):
+        response = self.get('/dns-lookup?domain=missing.etag.example&type=A', Accept='application/json')
+        self.assertIn('error', response.json)
+        self.assertEqual(response.headers['Cache-Control'], 'no-store')
+        self.assertNotIn('ETag', response.headers)
+
+
+class RenderCacheTest(AppTestCase):
+    zone = {('rendered.example', 'A'): (300, [bytes([10, 0, 2, 1])]),
+            ('aging.example', 'A'): (300, [bytes([10, 0, 2, 2])])}
+    path = '/dns-lookup?domain=rendered.example&type=A'
+
+    def test_rendered_bytes_are_reused(self):
+        first = self.get(self.path, Accept='application/json')
+        hits = app.render_cache.stats()['hits']
+        second = self.get(self.path, Accept='application/json')
+        self.assertEqual(second.get_data(), first.get_data())
+        self.assertEqual(app.render_cache.stats()['hits'], hits + 1)
+        cached = app.render_cache.get(('rendered.example', ('A',), 'json', 'identity'))
+        self.assertEqual(cached[2][1], first.get_data())
+
+    def test_formats_and_encodings_are_kept_apart(self):
+        with mock.patch.dict(app.app.config, DNS_GZIP_MIN_SIZE=0):
+            plain = self.get(self.path, Accept='text/html')
+            gzipped = self.get(self.path, Accept='text/html', **{'Accept-Encoding': 'gzip'})
+            as_json = self.get(self.path, Accept='application/json', **{'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertEqual(gzipped.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(gzipped.get_data()), plain.get_data())
+        self.assertEqual(json.loads(gzip.decompress(as_json.get_data()))['domain'], 'rendered.example')
+
+    def test_rerendered_as_ttls_count_down(self):
+        path = '/dns-lookup?domain=aging.example&type=A'
+        first = self.get(path, Accept='application/json').json
+        time.sleep(1.05)
+        second = self.get(path, Accept='application/json').json
+        self.assertEqual(second['records'][0]['ttl'], first['records'][0]['ttl'] - 1)
+
+    def test_not_modified_skips_rendering(self):
+        answers = [app.Answer((resolver.Record('unrendered.example', 1, 300, 1),))]
+        etag, body, headers = app.rendered_answers('unrendered.example', ('A',), 'json', 'identity',
+                                                   answers, lambda etag: True)
+        self.assertIsNone(body)
+        self.assertEqual(headers['ETag'], 'W/"%s"' % etag)
+        self.assertIsNone(app.render_cache.get(('unrendered.example', ('A',), 'json', 'identity')))
+
+
+class CountdownTest(AppTestCase):
+    def test_ttl_and_max_age_count_down(self):
+        key = ('aged.example', 'A')
+        app.answer_cache.put(key, (resolver.Record('aged.example', 1, 300, 1),), 300, age=100)
+        response = self.get('/dns-lookup?domain=aged.example&type=A', Accept='application/json')
+        self.assertEqual(response.json['records'][0]['ttl'], 200)
+        self.assertEqual(response.headers['Cache-Control'], 'max-age=200')
+
+
+class ServeStaleTest(AppTestCase):
+    zone = {('stale.example', 'A'): (1, [bytes([10, 0, 0, 1])]),
+            ('fresh.example', 'A'): (1, [bytes([10, 0, 0, 2])]),
+            ('gone.example', 'A'): (1, [bytes([10, 0, 0, 7])])}
+
+    def setUp(self):
+        super().setUp()
+        for patcher in (mock.patch.object(app.answer_cache, 'stale_ttl', 3600),
+                        mock.patch.object(app.backend, 'timeout', 0.1),
+                        mock.patch.dict(app.app.config, DNS_SERVE_STALE=True, DNS_STALE_DEADLINE=1.0)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def expire(self, name):
+        app.lookup(name, 'A')
+        time.sleep(1.05)
+        return app.answer_cache.stats()['stale_hits']
+
+    def test_one_refresh_per_key_then_recheck_period(self):
+        stale_hits = self.expire('stale.example')
+        self.stub.down = True
+        with ThreadPoolExecutor(16) as pool:
+            answers = list(pool.map(lambda _: app.lookup('stale.example', 'A'), range(16)))
+        self.assertTrue(all(isinstance(a, app.StaleAnswer) for a in answers))
+        # One refresh: a query and its retry
+        self.assertEqual(self.stub.queries.count(('stale.example', 'A')), 1 + 2)
+        start = time.monotonic()
+        self.assertIsInstance(app.lookup('stale.example', 'A'), app.StaleAnswer)
+        self.assertLess(time.monotonic() - start, 0.05)
+        self.assertEqual(self.stub.queries.count(('stale.example', 'A')), 3)
+        self.assertEqual(app.answer_cache.stats()['stale_hits'], stale_hits + 17)
+
+    def test_fresh_answer_is_not_counted_as_stale(self):
+        stale_hits = self.expire('fresh.example')
+        self.assertNotIsInstance(app.lookup('fresh.example', 'A'), app.StaleAnswer)
+        self.assertEqual(app.answer_cache.stats()['stale_hits'], stale_hits)
+
+    def test_nxdomain_is_not_papered_over(self):
+        self.expire('gone.example')
+        del self.stub.zone[('gone.example', 'A')]
+        response = self.get('/dns-lookup?domain=gone.example&type=A', Accept='application/json')
+        self.assertIn('NXDOMAIN', response.json['error'])
+        self.assertNotIn('stale', response.json)
+
+
+class AsgiTestCase(AppTestCase):
+    def asgi_get(self, path, query=b'', **headers):
+        """Runs one request through app.asgi_app; returns (status, headers, body)."""
+        scope = {'type': 'http', 'path': path, 'query_string': query, 'client': ('127.0.0.1', 0),
+                 'headers': [(k.lower().replace('_', '-').encode(), v.encode()) for k, v in headers.items()]}
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            messages.append(message)
+
+        asyncio.run(app.asgi_app(scope, receive, send))
+        start, body = messages
+        return start['status'], dict(start['headers']), body['body']
+
+
+class AsgiValidateStageTest(AsgiTestCase):
+    zone = {('asgi.example', 'A'): (300, [bytes([10, 0, 0, 3])])}
+
+    def validations(self):
+        return app.stage_seconds.labels('validate', app.app.config['DNS_BACKEND']).counts[:]
+
+    def test_only_lookups_are_validated(self):
+        before = self.validations()
+        status, headers, _ = self.asgi_get('/metrics', X_Server_Timing='1')
+        self.assertEqual(status, 200)
+        self.assertNotIn(b'validate', headers[b'server-timing'])
+        self.assertEqual(self.validations(), before)
+        status, headers, _ = self.asgi_get('/dns-lookup', b'domain=asgi.example&type=A', X_Server_Timing='1')
+        self.assertEqual(status, 200)
+        self.assertIn(b'validate;dur=', headers[b'server-timing'])
+        self.assertEqual(sum(self.validations()), sum(before) + 1)
+
+
+class ServerTimingTest(AsgiTestCase):
+    zone = {('timed.example', 'A'): (300, [bytes([10, 0, 3, 1])]),
+            ('timed.example', 'AAAA'): (300, [bytes(15) + b'\x01']),
+            ('batch.timed.example', 'A'): (300, [bytes([10, 0, 3, 2])]),
+            ('asgi.timed.example', 'A'): (300, [bytes([10, 0, 3, 3])])}
+
+    def stages(self, header):
+        return [part.split(';')[0] for part in header.split(', ')]
+
+    def test_only_when_asked(self):
+        response = self.get('/dns-lookup?domain=timed.example&type=A')
+        self.assertNotIn('Server-Timing', response.headers)
+
+    def test_lookup_stages(self):
+        response = self.get('/dns-lookup?domain=timed.example&type=A,AAAA', **{'X-Server-Timing': '1'})
+        self.assertEqual(self.stages(response.headers['Server-Timing']),
+                         ['validate', 'cache', 'upstream', 'render', 'total'])
+        # Cached now; the query parameter works too
+        response = self.get('/dns-lookup?domain=timed.example&type=A,AAAA&timing=1')
+        self.assertEqual(self.stages(response.headers['Server-Timing']), ['validate', 'cache', 'render', 'total'])
+
+    def test_batch_stages_include_pool_threads(self):
+        with self.client.post('/dns-lookup/batch?timing=1', json={'domains': ['batch.timed.example'],
+                                                                  'types': ['A']}) as response:
+            header = response.headers['Server-Timing']
+        self.assertEqual(self.stages(header), ['validate', 'cache', 'upstream', 'total'])
+
+    def test_asgi_stages(self):
+        _, headers, _ = self.asgi_get('/dns-lookup', b'domain=asgi.timed.example&type=A&timing=1')
+        self.assertEqual(self.stages(headers[b'server-timing'].decode()),
+                         ['validate', 'cache', 'upstream', 'render', 'total'])
+
+    def test_repeated_stages_are_summed(self):
+        self.assertEqual(app.server_timing([('cache', 0.001), ('upstream', 0.02), ('cache', 0.002)], 0.05),
+                         'cache;dur=3.000, upstream;dur=20.000, total;dur=50.000')
+
+
+class AdminProfileTest(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.dict(app.app.config, DNS_ADMIN_TOKEN='s3cret')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def profile(self, query, token='s3cret'):
+        return self.get('/admin/profile?' + query, Authorization='Bearer ' + token)
+
+    def test_requires_the_token(self):
+        self.assertEqual(self.profile('seconds=0.01', token='wrong').status_code, 401)
+        with mock.patch.dict(app.app.config, DNS_ADMIN_TOKEN=None):
+            self.assertEqual(self.profile('seconds=0.01').status_code, 404)
+
+    def test_rejects_bad_arguments(self):
+        for query in ('seconds=x', 'seconds=0', 'seconds=1000', 'interval=5', 'format=svg'):
+            self.assertEqual(self.profile(query).status_code, 400, query)
+
+    def test_pstats_download_loads(self):
+        response = self.profile('seconds=0.05&interval=0.005&format=pstats')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('profile.pstats', response.headers['Content-Disposition'])
+        fd, path = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as f:
+            f.write(response.get_data())
+        self.addCleanup(os.unlink, path)
+        self.assertTrue(pstats.Stats(path).stats)
+
+    def test_collapsed_stacks(self):
+        response = self.profile('seconds=0.05&interval=0.005')
+        self.assertEqual(response.mimetype, 'text/plain')
+        self.assertRegex(response.get_data(as_text=True), r'(?m)^\S.* \d+$')
+
+
+class SnapshotRemovalTest(unittest.TestCase):
+    def setUp(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.unlink, path)
+        self.key = ('deleted.example', 'A')
+        snapshot.write_snapshot(path, [(self.key, (resolver.Record('deleted.example', 1, 300, 1),),
+                                        time.time() + 300)])
+        reader = snapshot.SnapshotReader(path)
+        self.addCleanup(reader.close)
+        for patcher in (mock.patch.object(app, 'snapshot_reader', reader),
+                        mock.patch.object(app, 'removed_keys', set()),
+                        mock.patch.dict(app.app.config, DNS_SNAPSHOT_PATH=path)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_negative_answer_hides_snapshot_copy(self):
+        self.assertRaises(resolver.NXDomain, app.store_answer, self.key, 3, [], 300)
+        self.assertRaises(resolver.NXDomain, app.cached_answer, self.key)
+        app.negative_cache.discard(self.key)
+        self.assertIsNone(app.cached_answer(self.key))
+
+    def test_removed_key_is_left_out_of_the_next_snapshot(self):
+        self.assertEqual(app.store_answer(self.key, 0, [], 300), [])
+        app.save_snapshot()
+        self.addCleanup(app.snapshot_reader.close)
+        self.assertIsNone(app.snapshot_reader.get(self.key))
+        self.assertEqual(app.removed_keys, set())
+
+
+if __name__ == '__main__':
+    unittest.main()
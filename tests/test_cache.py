@@ -0,0 +1,157 @@
+import asyncio
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import AnswerCache, SingleFlight
+
+
+class AnswerCacheTest(unittest.TestCase):
+    def test_expiry(self):
+        cache = AnswerCache()
+        cache.put('a', 'answer', 0.05)
+        cache.put('gone', 'answer', 0)
+        self.assertEqual(cache.get('a'), 'answer')
+        self.assertIsNone(cache.get('gone'))
+        time.sleep(0.06)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['size'], 0)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = AnswerCache(maxsize=2)
+        cache.put('a', 1, 300)
+        cache.put('b', 2, 300)
+        cache.get('a')
+        cache.put('c', 3, 300)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.get('a'), cache.get('c')), (1, 3))
+        stats = cache.stats()
+        self.assertEqual((stats['size'], stats['hits'], stats['misses']), (2, 3, 1))
+
+    def test_put_replaces_and_refreshes(self):
+        cache = AnswerCache(maxsize=2)
+        cache.put('a', 1, 300)
+        cache.put('b', 2, 300)
+        cache.put('a', 10, 300)
+        cache.put('c', 3, 300)
+        self.assertEqual(cache.get('a'), 10)
+        self.assertIsNone(cache.get('b'))
+
+    def test_prefetch_near_expiry(self):
+        prefetched = []
+        cache = AnswerCache(prefetch=prefetched.append, prefetch_fraction=0.5, prefetch_min_hits=2)
+        cache.put('hot', 'answer', 0.2)
+        cache.put('cold', 'answer', 0.2)
+        cache.get('hot')
+        self.assertEqual(prefetched, [])
+        time.sleep(0.12)
+        for _ in range(3):
+            cache.get('hot')
+        cache.get('cold')
+        self.assertEqual(prefetched, ['hot'])
+        self.assertEqual(cache.stats()['prefetches'], 1)
+        # The refreshed entry starts counting again
+        cache.put('hot', 'answer', 0.2)
+        cache.get('hot')
+        self.assertEqual(prefetched, ['hot'])
+
+    def test_stale_window(self):
+        cache = AnswerCache(stale_ttl=0.2, stale_recheck=0.1)
+        cache.put('a', 'answer', 0.05)
+        self.assertIsNone(cache.get_stale('missing'))
+        time.sleep(0.06)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get_stale('a'), ('answer', False))
+        cache.refresh_failed('a')
+        self.assertEqual(cache.get_stale('a'), ('answer', True))
+        time.sleep(0.1)
+        self.assertEqual(cache.get_stale('a'), ('answer', False))
+        time.sleep(0.1)
+        self.assertIsNone(cache.get_stale('a'))
+        cache.get('a')
+        self.assertEqual(cache.stats()['size'], 0)
+
+    def test_no_stale_window_by_default(self):
+        cache = AnswerCache()
+        cache.put('a', 'answer', 0.01)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get_stale('a'))
+        cache.stale_served()
+        self.assertEqual(cache.stats()['stale_hits'], 1)
+
+    def test_age(self):
+        cache = AnswerCache()
+        cache.put('a', 'answer', 300, age=100)
+        value, age = cache.get_aged('a')
+        self.assertEqual(value, 'answer')
+        self.assertAlmostEqual(age, 100, delta=1)
+        self.assertAlmostEqual(cache.items()[0][2], 200, delta=1)
+        cache.put('old', 'answer', 300, age=300)
+        self.assertIsNone(cache.get_aged('old'))
+
+    def test_values_are_stored_as_given(self):
+        # The age lives in the entry, so cached answers carry no extra state
+        cache = AnswerCache()
+        records = ('record',)
+        cache.put('a', records, 300, age=10)
+        self.assertIs(cache.get_aged('a')[0], records)
+        self.assertIs(cache.get('a'), records)
+
+
+class SingleFlightTest(unittest.TestCase):
+    def test_concurrent_calls_share_one_execution(self):
+        flight = SingleFlight()
+        calls = []
+        release = threading.Event()
+
+        def resolve():
+            calls.append(1)
+            release.wait(5)
+            return 'answer'
+
+        with ThreadPoolExecutor(8) as pool:
+            futures = [pool.submit(flight.do, 'key', resolve) for _ in range(8)]
+            while flight.stats()['coalesced'] < 7:
+                time.sleep(0.001)
+            release.set()
+            self.assertEqual([f.result() for f in futures], ['answer'] * 8)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight.stats(), {'in_flight': 0, 'coalesced': 7})
+        self.assertEqual(flight.do('key', lambda: 'again'), 'again')
+
+    def test_error_reaches_every_caller(self):
+        flight = SingleFlight()
+        release = threading.Event()
+
+        def fail():
+            release.wait(5)
+            raise ValueError('upstream failed')
+
+        with ThreadPoolExecutor(4) as pool:
+            futures = [pool.submit(flight.do, 'key', fail) for _ in range(4)]
+            while flight.stats()['coalesced'] < 3:
+                time.sleep(0.001)
+            release.set()
+            for future in futures:
+                self.assertRaisesRegex(ValueError, 'upstream failed', future.result)
+
+    def test_async_calls_share_one_task(self):
+        flight = SingleFlight()
+        calls = []
+
+        async def resolve():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return 'answer'
+
+        async def main():
+            return await asyncio.gather(*(flight.do_async('key', resolve) for _ in range(8)))
+
+        self.assertEqual(asyncio.run(main()), ['answer'] * 8)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight.stats(), {'in_flight': 0, 'coalesced': 7})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from limits import AdmissionController, Overloaded, RateLimiter
+
+
+class AdmissionControllerTest(unittest.TestCase):
+    def test_refuses_past_the_limit(self):
+        admission = AdmissionController(2)
+        admission.acquire()
+        admission.acquire()
+        self.assertRaisesRegex(Overloaded, 'too many', admission.acquire)
+        admission.release()
+        admission.acquire()
+        stats = admission.stats()
+        self.assertEqual((stats['active'], stats['admitted'], stats['rejected']), (2, 3, 1))
+
+    def test_waiter_gets_a_released_slot(self):
+        admission = AdmissionController(1, queue_size=1, queue_timeout=5)
+        admission.acquire()
+        with ThreadPoolExecutor(1) as pool:
+            waiter = pool.submit(admission.acquire)
+            while admission.stats()['queue_depth'] < 1:
+                time.sleep(0.001)
+            self.assertRaisesRegex(Overloaded, 'too many', admission.acquire)
+            time.sleep(0.02)
+            admission.release()
+            waiter.result()
+        stats = admission.stats()
+        self.assertEqual((stats['active'], stats['queue_depth'], stats['max_queue_depth']), (1, 0, 1))
+        self.assertGreaterEqual(stats['max_wait_seconds'], 0.02)
+
+    def test_waiter_times_out(self):
+        admission = AdmissionController(1, queue_size=1, queue_timeout=0.05)
+        admission.acquire()
+        start = time.monotonic()
+        self.assertRaisesRegex(Overloaded, 'timed out', admission.acquire)
+        self.assertGreaterEqual(time.monotonic() - start, 0.05)
+        stats = admission.stats()
+        self.assertEqual((stats['active'], stats['queue_depth'], stats['timed_out']), (1, 0, 1))
+
+    def test_never_more_than_limit_active(self):
+        admission = AdmissionController(3, queue_size=100, queue_timeout=5)
+        lock = threading.Lock()
+        running = []
+
+        def work(_):
+            admission.acquire()
+            try:
+                with lock:
+                    running.append(admission.active)
+                time.sleep(0.005)
+            finally:
+                admission.release()
+
+        with ThreadPoolExecutor(16) as pool:
+            list(pool.map(work, range(64)))
+        self.assertLessEqual(max(running), 3)
+        self.assertEqual(admission.stats()['admitted'], 64)
+
+
+class RateLimiterTest(unittest.TestCase):
+    def test_burst_then_refill(self):
+        limiter = RateLimiter(rate=20, burst=2)
+        self.assertEqual([limiter.allow('a'), limiter.allow('a')], [0, 0])
+        delay = limiter.allow('a')
+        self.assertAlmostEqual(delay, 0.05, delta=0.01)
+        self.assertEqual(limiter.allow('b'), 0)
+        time.sleep(delay)
+        self.assertEqual(limiter.allow('a'), 0)
+        self.assertGreater(limiter.allow('a'), 0)
+
+    def test_clients_are_bounded_by_an_lru(self):
+        limiter = RateLimiter(rate=1, burst=1, max_clients=2)
+        for client in ('a', 'b', 'c'):
+            limiter.allow(client)
+        self.assertGreater(limiter.allow('c'), 0)
+        self.assertEqual(limiter.stats()['clients'], 2)
+        # An evicted client starts again with a full bucket
+        self.assertEqual(limiter.allow('a'), 0)
+        self.assertEqual(limiter.stats()['clients'], 2)
+
+    def test_stats_list_the_most_throttled(self):
+        limiter = RateLimiter(rate=1, burst=1)
+        for client, requests in (('a', 4), ('b', 2), ('c', 1)):
+            for _ in range(requests):
+                limiter.allow(client)
+        stats = limiter.stats(top=1)
+        self.assertEqual((stats['throttled'], stats['top_throttled']), (4, {'a': 3}))
+
+
+if __name__ == '__main__':
+    unittest.main()
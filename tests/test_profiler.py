@@ -0,0 +1,94 @@
+import os
+import pstats
+import tempfile
+import threading
+import time
+import unittest
+from collections import Counter
+
+import profiler
+
+
+def outer():
+    return inner()
+
+
+def inner():
+    return 1
+
+
+def recursive():
+    return recursive()
+
+
+def label(fn):
+    code = fn.__code__
+    return code.co_filename, code.co_firstlineno, code.co_name
+
+
+def load(data):
+    fd, path = tempfile.mkstemp()
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    try:
+        return pstats.Stats(path).stats
+    finally:
+        os.unlink(path)
+
+
+class PstatsDumpTest(unittest.TestCase):
+    def test_loads_with_own_and_cumulative_time(self):
+        samples = Counter({('MainThread', (outer.__code__, inner.__code__)): 3,
+                           ('MainThread', (outer.__code__,)): 1})
+        stats = load(profiler.pstats_dump(samples, 0.01))
+        cc, nc, tt, ct, callers = stats[label(outer)]
+        self.assertEqual((cc, nc), (4, 4))
+        self.assertAlmostEqual(tt, 0.01)
+        self.assertAlmostEqual(ct, 0.04)
+        self.assertEqual(callers, {})
+        cc, nc, tt, ct, callers = stats[label(inner)]
+        self.assertEqual((cc, nc), (3, 3))
+        self.assertAlmostEqual(tt, 0.03)
+        self.assertAlmostEqual(ct, 0.03)
+        self.assertEqual(list(callers), [label(outer)])
+
+    def test_recursion_is_counted_once_per_sample(self):
+        code = recursive.__code__
+        stats = load(profiler.pstats_dump(Counter({('MainThread', (code, code, code)): 2}), 0.5))
+        cc, nc, tt, ct, callers = stats[label(recursive)]
+        self.assertEqual((cc, nc, tt, ct), (2, 2, 1.0, 1.0))
+        self.assertEqual(callers[label(recursive)][:2], (4, 4))
+
+
+class SampleTest(unittest.TestCase):
+    def test_samples_other_threads(self):
+        stop = threading.Event()
+
+        def spin():
+            while not stop.is_set():
+                inner()
+
+        thread = threading.Thread(target=spin, name='spinner')
+        thread.start()
+        try:
+            samples = profiler.sample(0.1, 0.005)
+        finally:
+            stop.set()
+            thread.join()
+        stacks = [stack for (name, stack), _ in samples.items() if name == 'spinner']
+        self.assertTrue(stacks)
+        self.assertTrue(all(spin.__code__ in stack for stack in stacks))
+        self.assertIn('spinner;', profiler.collapsed(samples))
+
+    def test_one_run_at_a_time(self):
+        thread = threading.Thread(target=profiler.sample, args=(0.2,))
+        thread.start()
+        try:
+            time.sleep(0.05)
+            self.assertRaises(profiler.Busy, profiler.sample, 0.01)
+        finally:
+            thread.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
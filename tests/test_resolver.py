@@ -0,0 +1,225 @@
+import asyncio
+import socket
+import struct
+import threading
+import unittest
+
+import resolver
+from tests.packets import PACKETS
+
+QID = 0x1234
+
+
+def answers(packet, wanted=None):
+    rcode, records, negative_ttl = resolver.parse_response(PACKETS[packet], QID, wanted)
+    return rcode, [(r.name, r.type, r.ttl, r.data) for r in records], negative_ttl
+
+
+class ParseResponseTest(unittest.TestCase):
+    def test_compressed_owner_names(self):
+        self.assertEqual(answers('a_compressed'), (0, [
+            ('example.com', 'A', 300, '93.184.216.34'),
+            ('example.com', 'A', 120, '93.184.216.35'),
+        ], None))
+
+    def test_compressed_rdata_names(self):
+        self.assertEqual(answers('cname_chain')[1], [
+            ('www.example.com', 'CNAME', 3600, 'example.com'),
+            ('example.com', 'A', 300, '93.184.216.34'),
+        ])
+        self.assertEqual([r[3] for r in answers('ns')[1]], ['a.iana-servers.net', 'b.iana-servers.net'])
+
+    def test_record_types(self):
+        expected = {
+            'aaaa': ('example.com', 'AAAA', 60, '2606:2800:220:1:248:1893:1a94:6c34'),
+            'ptr': ('34.216.184.93.in-addr.arpa', 'PTR', 3600, 'example.com'),
+            'mx': ('example.com', 'MX', 300, '10 mail.example.com'),
+            'txt': ('example.com', 'TXT', 300, '"v=spf1 -all" "say \\"hi\\"!"'),
+            'soa': ('example.com', 'SOA', 3600,
+                    'ns.example.com hostmaster.example.com 2024010101 7200 3600 1209600 300'),
+            'srv': ('_sip._tcp.example.com', 'SRV', 300, '10 60 5060 sip.example.com'),
+            'caa': ('example.com', 'CAA', 300, '0 issue "letsencrypt.org"'),
+        }
+        for packet, record in expected.items():
+            with self.subTest(packet=packet):
+                self.assertEqual(answers(packet), (0, [record], None))
+
+    def test_wanted_types_only(self):
+        self.assertEqual(answers('cname_chain', wanted=(1,))[1],
+                         [('example.com', 'A', 300, '93.184.216.34')])
+
+    def test_negative_answers(self):
+        # RFC 2308: the negative TTL is min(SOA TTL, SOA MINIMUM)
+        self.assertEqual(answers('nxdomain'), (3, [], 300))
+        self.assertEqual(answers('nodata'), (0, [], 300))
+        self.assertEqual(answers('servfail'), (2, [], None))
+
+    def test_malformed_packets(self):
+        for packet in ('cut_short', 'pointer_loop', 'pointer_out_of_range', 'wrong_id'):
+            with self.subTest(packet=packet):
+                self.assertRaises(resolver.ResolverError, resolver.parse_response, PACKETS[packet], QID)
+
+    def test_truncated(self):
+        self.assertRaises(resolver.Truncated, resolver.parse_response, PACKETS['truncated_tc'], QID)
+
+    def test_question_must_match(self):
+        self.assertEqual(resolver.parse_response(PACKETS['a_compressed'], QID, None, ('EXAMPLE.com.', 1))[0], 0)
+        for question in (('example.org', 1), ('example.com', 28)):
+            with self.subTest(question=question):
+                self.assertRaises(resolver.Mismatch, resolver.parse_response,
+                                  PACKETS['a_compressed'], QID, None, question)
+
+    def test_query_round_trip(self):
+        query = resolver.build_query('Example.COM', 16, QID)
+        self.assertEqual(resolver.read_name(memoryview(query), 12)[0], 'Example.COM')
+        self.assertRaises(resolver.ResolverError, resolver.encode_name, 'a' * 64 + '.com')
+
+
+def answer_for(query, packet):
+    # The corpus packets carry QID; swap in the id of the query being answered
+    return query[:2] + PACKETS[packet][2:]
+
+
+def truncated_for(query):
+    # Header with QR and TC set and only the question, echoed from the query
+    end = resolver.skip_name(memoryview(query), 12) + 4
+    return query[:2] + struct.pack('!HHHHH', 0x8380, 1, 0, 0, 0) + query[12:end]
+
+
+class TruncationFallbackTest(unittest.TestCase):
+    """A server that truncates every UDP answer and answers in full over TCP."""
+
+    def setUp(self):
+        self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp.bind(('127.0.0.1', 0))
+        self.port = self.udp.getsockname()[1]
+        self.tcp = socket.create_server(('127.0.0.1', self.port))
+        self.queries = []
+        threading.Thread(target=self.serve_udp, daemon=True).start()
+        threading.Thread(target=self.serve_tcp, daemon=True).start()
+
+    def tearDown(self):
+        self.udp.close()
+        self.tcp.close()
+
+    def udp_answers(self, query):
+        return [truncated_for(query)]
+
+    def serve_udp(self):
+        try:
+            while True:
+                query, peer = self.udp.recvfrom(512)
+                self.queries.append(('udp', query))
+                for answer in self.udp_answers(query):
+                    self.udp.sendto(answer, peer)
+        except OSError:
+            pass
+
+    def serve_tcp(self):
+        try:
+            while True:
+                conn, _ = self.tcp.accept()
+                with conn:
+                    size, = struct.unpack('!H', resolver.recv_exactly(conn, 2))
+                    query = bytes(resolver.recv_exactly(conn, size))
+                    self.queries.append(('tcp', query))
+                    answer = answer_for(query, 'a_compressed')
+                    conn.sendall(struct.pack('!H', len(answer)) + answer)
+        except OSError:
+            pass
+
+    def check(self, result):
+        rcode, records, _ = result
+        self.assertEqual((rcode, [r.data for r in records]), (0, ['93.184.216.34', '93.184.216.35']))
+        self.assertEqual([transport for transport, _ in self.queries], ['udp', 'tcp'])
+        # EDNS0 OPT record on UDP only
+        self.assertEqual(self.queries[0][1][10:12], b'\x00\x01')
+        self.assertEqual(self.queries[1][1][10:12], b'\x00\x00')
+
+    def test_query(self):
+        self.check(resolver.query('example.com', 1, '127.0.0.1', self.port))
+
+    def test_query_async(self):
+        self.check(asyncio.run(resolver.query_async('example.com', 1, '127.0.0.1', self.port)))
+
+
+class SpoofedAnswerTest(TruncationFallbackTest):
+    """An answer to another question, with the right id, arrives first and is ignored."""
+
+    def udp_answers(self, query):
+        return [answer_for(query, 'aaaa'), truncated_for(query)]
+
+
+NSLOOKUP_HEADER = 'Server:\t\t127.0.0.1\nAddress:\t127.0.0.1#53\n\n'
+
+
+class ParseNslookupTest(unittest.TestCase):
+    backend = resolver.SubprocessBackend(server='127.0.0.1', default_ttl=60)
+
+    def parse(self, body, returncode=0):
+        rcode, records, negative_ttl = self.backend.parse((NSLOOKUP_HEADER + body).encode(), returncode)
+        return rcode, [(r.name, r.type, r.data) for r in records], negative_ttl
+
+    def test_answers(self):
+        self.assertEqual(self.parse('Non-authoritative answer:\nName:\texample.com\nAddress: 93.184.216.34\n'
+                                    'Name:\texample.com\nAddress: 2606:2800:220:1:248:1893:1a94:6c34\n'),
+                         (0, [('example.com', 'A', '93.184.216.34'),
+                              ('example.com', 'AAAA', '2606:2800:220:1:248:1893:1a94:6c34')], None))
+        self.assertEqual(self.parse('example.com\tmail exchanger = 10 mail.example.com.\n'),
+                         (0, [('example.com', 'MX', '10 mail.example.com')], None))
+
+    def test_negative_answers(self):
+        self.assertEqual(self.parse("** server can't find nx.example.com: NXDOMAIN\n", 1), (3, [], 60))
+        self.assertEqual(self.parse("*** Can't find example.com: No answer\n"), (0, [], 60))
+
+    def test_server_failures(self):
+        self.assertEqual(self.parse(';; Got SERVFAIL reply from 127.0.0.1, trying next server\n'
+                                    "** server can't find example.com: SERVFAIL\n", 1)[0], 2)
+        self.assertEqual(self.parse("** server can't find example.com: REFUSED\n", 1)[0], 5)
+
+    def test_unreachable(self):
+        for body, returncode in ((';; connection timed out; no servers could be reached\n', 1),
+                                 (';; communications error to 127.0.0.1#53: connection refused\n', 1),
+                                 ("** server can't find example.com: BADCOOKIE\n", 1),
+                                 ('', 1)):
+            with self.subTest(body=body):
+                self.assertRaises(resolver.ResolverError, self.parse, body, returncode)
+
+    def test_warnings(self):
+        self.assertEqual(self.parse(';; Truncated, retrying in TCP mode.\n'
+                                    'Name:\texample.com\nAddress: 93.184.216.34\n')[1],
+                         [('example.com', 'A', '93.184.216.34')])
+
+
+class SubprocessArgvTest(unittest.TestCase):
+    def test_argv(self):
+        backend = resolver.SubprocessBackend(server='127.0.0.1', port=5353)
+        self.assertEqual(backend.argv('Example.COM.', 'MX'),
+                         ['nslookup', '-type=MX', '-port=5353', 'example.com', '127.0.0.1'])
+
+    def test_rejects_injection(self):
+        backends = (resolver.SubprocessBackend(server='127.0.0.1'),
+                    resolver.PooledSubprocessBackend(server='127.0.0.1'))
+        for name, rtype in (('-query=any', 'A'), ('a.com; id', 'A'), ('a.com\nserver 10.0.0.1', 'A'),
+                            ('$(id).com', 'A'), ('a.com', 'A\nserver 10.0.0.1')):
+            with self.subTest(name=name, rtype=rtype):
+                self.assertRaises(resolver.ResolverError, backends[0].argv, name, rtype)
+                self.assertRaises(resolver.ResolverError, backends[1].query, name, rtype)
+
+
+class NormalizeNameTest(unittest.TestCase):
+    def test_normalizes(self):
+        self.assertEqual(resolver.normalize_name(' Example.COM. '), 'example.com')
+        self.assertEqual(resolver.normalize_name('Bücher.de'), 'xn--bcher-kva.de')
+        # IDNA 2008: ß is kept, where IDNA 2003 would have answered for fass.de
+        self.assertEqual(resolver.normalize_name('faß.de'), 'xn--fa-hia.de')
+        self.assertEqual(resolver.normalize_name('::0001'), '::1')
+
+    def test_rejects(self):
+        for name in ('', 'a;id', '☃.com', 'a b.com', '-x.com', 'x..y', 'a' * 64 + '.com', 'a.' * 127 + 'com'):
+            with self.subTest(name=name):
+                self.assertRaises(ValueError, resolver.normalize_name, name)
+
+
+if __name__ == '__main__':
+    unittest.main()
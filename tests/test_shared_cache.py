@@ -0,0 +1,46 @@
+import os
+import tempfile
+import unittest
+
+from resolver import Record
+from shared_cache import SharedAnswerCache
+from tests.test_snapshot import RECORDS, fields
+
+
+class SharedAnswerCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.path = os.path.join(self.dir.name, 'answers')
+
+    def test_round_trip_between_mappings(self):
+        writer = SharedAnswerCache(self.path, slots=64)
+        self.assertTrue(writer.put(('example.com', 'A'), RECORDS, 100))
+        reader = SharedAnswerCache(self.path, slots=64)
+        records, remaining = reader.get(('example.com', 'A'))
+        self.assertEqual(fields(records), fields(RECORDS))
+        self.assertAlmostEqual(remaining, 100, delta=5)
+        self.assertIsNone(reader.get(('example.com', 'AAAA')))
+
+    def test_expired_and_oversized_entries(self):
+        cache = SharedAnswerCache(self.path, slots=64, slot_size=128)
+        cache.put(('old.example', 'A'), RECORDS[:1], -1)
+        self.assertIsNone(cache.get(('old.example', 'A')))
+        big = tuple(Record('example.com', 16, 300, '"%s"' % ('x' * 40)) for _ in range(4))
+        self.assertFalse(cache.put(('big.example', 'TXT'), big, 100))
+
+    def test_replaces_within_a_full_set(self):
+        cache = SharedAnswerCache(self.path, slots=4)
+        for i in range(10):
+            cache.put(('host%d.example' % i, 'A'), RECORDS[:1], 100 + i)
+        self.assertIsNotNone(cache.get(('host9.example', 'A')))
+        cache.put(('host9.example', 'A'), RECORDS[1:2], 100)
+        self.assertEqual(fields(cache.get(('host9.example', 'A'))[0]), fields(RECORDS[1:2]))
+
+    def test_rejects_a_different_layout(self):
+        SharedAnswerCache(self.path, slots=64)
+        self.assertRaises(ValueError, SharedAnswerCache, self.path, slots=128)
+
+
+if __name__ == '__main__':
+    unittest.main()
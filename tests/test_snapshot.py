@@ -0,0 +1,50 @@
+import os
+import tempfile
+import time
+import unittest
+
+import snapshot
+from resolver import Record
+
+RECORDS = (
+    Record('example.com', 1, 300, 0x5DB8D822),
+    Record('example.com', 28, 60, bytes.fromhex('26062800022000010248189319a46c34')),
+    Record('example.com', 16, 300, '"v=spf1 -all"'),
+    Record('bücher.example', 15, 300, '10 mail.example.com'),
+)
+
+
+def fields(records):
+    return [(r.name, r.qtype, r.ttl, r.rdata) for r in records]
+
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.unlink, self.path)
+
+    def test_round_trip(self):
+        now = time.time()
+        snapshot.write_snapshot(self.path, [
+            (('example.com', 'A'), RECORDS, now + 100),
+            (('gone.example', 'A'), RECORDS[:1], now - 1),
+        ] + [(('host%d.example' % i, 'A'), RECORDS[:1], now + 100) for i in range(50)])
+        reader = snapshot.SnapshotReader(self.path)
+        self.addCleanup(reader.close)
+        records, remaining = reader.get(('example.com', 'A'))
+        self.assertEqual(fields(records), fields(RECORDS))
+        self.assertAlmostEqual(remaining, 100, delta=5)
+        self.assertIsNotNone(reader.get(('host37.example', 'A')))
+        self.assertIsNone(reader.get(('gone.example', 'A')))
+        self.assertIsNone(reader.get(('example.com', 'AAAA')))
+        self.assertEqual(len(list(reader.entries())), 51)
+
+    def test_rejects_other_files(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'not a snapshot at all')
+        self.assertRaises(ValueError, snapshot.SnapshotReader, self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()